@@ -0,0 +1,74 @@
+import re
+import unicodedata
+
+# サマリー表の列見出し (長いものから順に。見出しの出現順 = 数値の並び順)
+COLUMN_PATTERN = re.compile(
+    r"親会社(?:株主|の所有者)に帰属する(?:当期|四半期|中間)(?:純)?利益"
+    r"|(?:当期|四半期|中間)包括利益(?:合計額?)?"
+    r"|税引前(?:当期|四半期|中間)?(?:純)?利益"
+    r"|売上高|営業収益|売上収益|経常収益|営業総収入"
+    r"|営業利益|経常利益"
+    r"|(?:当期|四半期|中間)(?:純)?利益"
+)
+SALES_COLUMNS = {"売上高", "営業収益", "売上収益", "経常収益", "営業総収入"}
+PROFIT_COLUMN_PREFIX = "親会社"
+# 経営成績の行の先頭 (例: 2025年3月期第2四半期, 2025年3月期中間期)
+PERIOD_PATTERN = re.compile(r"^\d{4}年\d{1,2}月期(?:第\d四半期|中間期)?")
+# 金額・増減率 (△▲ はマイナス、単独の - ― は「記載なし」)
+VALUE_PATTERN = re.compile(r"[△▲]\s?\d[\d,]*(?:\.\d+)?|-?\d[\d,]*(?:\.\d+)?|[-―‐—]")
+
+def parse_earnings_figures(text):
+    """
+    決算短信1ページ目のサマリー表 (経営成績) から、当期の売上高と親会社株主に帰属する当期純利益の増減率を取り出す
+    戻り値: {"sales_growth": "+5.2%", "profit_growth": "△3.1%"} (読み取れなければ None)
+    """
+    if not text:
+        return None
+    # 全角数字・全角記号を半角にそろえる (△ はそのまま残る)
+    lines = [line.strip() for line in unicodedata.normalize("NFKC", text).splitlines()]
+
+    start = next((i for i, line in enumerate(lines) if "経営成績" in line), None)
+    if start is None:
+        return None
+
+    # 見出し (単位「百万円」の行まで) から列の並びを読む
+    header = ""
+    for i in range(start, min(start + 15, len(lines))):
+        if "百万円" in lines[i]:
+            break
+        header += re.sub(r"\s", "", lines[i])
+    else:
+        return None
+    columns = COLUMN_PATTERN.findall(header)
+    sales_index = next((n for n, c in enumerate(columns) if c in SALES_COLUMNS), None)
+    profit_index = next((n for n, c in enumerate(columns) if c.startswith(PROFIT_COLUMN_PREFIX)), None)
+    if sales_index is None or profit_index is None:
+        return None
+
+    # 単位行の次から、最初の期 (当期) の数値を読む (数値が次の行に折り返されている場合もある)
+    values = None
+    for line in lines[i + 1:i + 10]:
+        period = PERIOD_PATTERN.match(line)
+        if values is None:
+            if period:
+                values = VALUE_PATTERN.findall(line[period.end():])
+            continue
+        if period or len(values) >= len(columns) * 2:
+            break
+        values += VALUE_PATTERN.findall(line)
+    if values is None or len(values) < len(columns) * 2:
+        return None
+
+    return {
+        "sales_growth": _format_growth(values[sales_index * 2 + 1]),
+        "profit_growth": _format_growth(values[profit_index * 2 + 1]),
+    }
+
+def _format_growth(value):
+    """増減率をプロンプトの出力形式 ("+10.5%", "△5.2%", "-") にそろえる"""
+    value = value.replace(" ", "")
+    if value in {"-", "―", "‐", "—"}:
+        return "-"
+    if value[0] in "△▲-":
+        return f"△{value[1:]}%"
+    return f"+{value}%"
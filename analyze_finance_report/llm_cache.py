@@ -0,0 +1,64 @@
+import json
+import hashlib
+from sqlalchemy.dialects.postgresql import insert
+from common.database import SessionLocal
+from common.models import LlmResultCache
+
+class LlmCache:
+    """
+    Geminiの分析結果を (プロンプトの種類, バージョン, モデル名, 入力のハッシュ) で保存する
+    プロンプトを変更したときは PROMPT_VERSIONS のバージョンを上げると、その種類のキャッシュだけが無効になる
+    """
+    def __init__(self, model_name, template_versions):
+        self.model_name = model_name
+        self.template_versions = template_versions
+
+    @staticmethod
+    def hash_input(*parts):
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, template_id, text_hash):
+        db = SessionLocal()
+        try:
+            row = db.query(LlmResultCache.result).filter(
+                LlmResultCache.template_id == template_id,
+                LlmResultCache.template_version == self.template_versions[template_id],
+                LlmResultCache.model_name == self.model_name,
+                LlmResultCache.text_hash == text_hash
+            ).first()
+            return json.loads(row[0]) if row else None
+        finally:
+            db.close()
+
+    def put(self, template_id, text_hash, result):
+        db = SessionLocal()
+        try:
+            db.execute(insert(LlmResultCache).values(
+                template_id=template_id,
+                template_version=self.template_versions[template_id],
+                model_name=self.model_name,
+                text_hash=text_hash,
+                result=json.dumps(result, ensure_ascii=False)
+            ).on_conflict_do_nothing(constraint="uix_llm_result_cache_key"))
+            db.commit()
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def purge_old_versions(self):
+        """現在のバージョン以外のキャッシュを削除する (種類ごと)"""
+        db = SessionLocal()
+        try:
+            deleted = 0
+            for template_id, version in self.template_versions.items():
+                deleted += db.query(LlmResultCache).filter(
+                    LlmResultCache.template_id == template_id,
+                    LlmResultCache.template_version != version
+                ).delete(synchronize_session=False)
+            db.commit()
+            if deleted:
+                print(f"Purged {deleted} outdated LLM cache entries")
+        finally:
+            db.close()
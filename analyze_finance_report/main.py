@@ -2,13 +2,39 @@ import os
 import io
 import json
 import time
+import socket
 import requests
+from datetime import timedelta
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import google.generativeai as genai
-from pypdf import PdfReader
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from common.database import SessionLocal
 from common.models import Disclosure
 from common.notification import send_gmail
+from common.classifier import DisclosureClassifier, CATEGORY_EARNINGS, CATEGORY_BENEFITS
+from common.priority import refresh_pending_priorities
+from rate_limiter import DbRateLimiter
+from pdf_cache import PdfCache
+from pdf_extract import extract_relevant_text, extract_all_pages
+from llm_cache import LlmCache
+from retry import is_transient_error, backoff_seconds
+from metrics import AnalysisMetrics
+from earnings_parser import parse_earnings_figures
+from text_preprocess import preprocess_text, estimate_tokens
+
+GEMINI_MODEL = "gemini-2.5-flash" # 高速・安価なモデル
+# プロンプトのバージョン (プロンプトを変更したら上げる。その種類の分析結果キャッシュだけが無効になる)
+PROMPT_VERSIONS = {
+    "earnings": 1,
+    "earnings_summary": 1,
+    "benefits": 1,
+    "default": 1,
+    "chunk": 1,
+}
 
 class FinanceAnalyzer:
     def __init__(self):
@@ -17,47 +43,160 @@ class FinanceAnalyzer:
         if not api_key:
             raise ValueError("GEMINI_API_KEY is not set")
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash") # 高速・安価なモデル
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        # 同じ入力の分析結果を再利用するキャッシュ
+        self.llm_cache = LlmCache(GEMINI_MODEL, PROMPT_VERSIONS)
+        self.llm_cache.purge_old_versions()
+        # カテゴリ未設定の既存レコード用
+        self.classifier = DisclosureClassifier()
+        # 並列ワーカー数 (コンテナを増やしても SKIP LOCKED で同じレコードは取り合わない)
+        self.workers = int(os.environ.get("ANALYSIS_WORKERS", "4"))
+        self.worker_id = os.environ.get("ANALYZER_ID", f"{socket.gethostname()}-{os.getpid()}")
+        # この時間を過ぎても IN_PROGRESS のままのレコードは、ワーカーが落ちたとみなして PENDING に戻す
+        self.claim_timeout = int(os.environ.get("ANALYSIS_CLAIM_TIMEOUT", "600"))
+        # 一時的なエラー (429/503、タイムアウトなど) の再試行回数と待ち時間(秒)。回数を超えたら DEAD にする
+        self.max_attempts = int(os.environ.get("ANALYSIS_MAX_ATTEMPTS", "5"))
+        self.retry_base = int(os.environ.get("ANALYSIS_RETRY_BASE", "60"))
+        self.retry_max = int(os.environ.get("ANALYSIS_RETRY_MAX", "3600"))
+        # この時間以内に再試行予定のレコードがあれば、バッチを終了せずに待つ
+        self.retry_wait_limit = int(os.environ.get("ANALYSIS_RETRY_WAIT_LIMIT", "600"))
+        # Gemini APIの呼び出し回数制限 (全ワーカー・全コンテナ合計) と1回あたりのタイムアウト(秒)
+        self.gemini_limiter = DbRateLimiter(
+            "gemini", float(os.environ.get("GEMINI_RPM", "10")), int(os.environ.get("GEMINI_BURST", "3"))
+        )
+        self.gemini_timeout = float(os.environ.get("GEMINI_TIMEOUT", "120"))
+        # ダウンロード済みPDFと抽出テキストのキャッシュ
+        self.pdf_cache = PdfCache(
+            os.environ.get("PDF_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_cache")),
+            max_bytes=int(os.environ.get("PDF_CACHE_MAX_MB", "500")) * 1024 * 1024,
+            ttl_seconds=int(os.environ.get("PDF_CACHE_TTL", "86400")),
+            max_download_bytes=int(os.environ.get("PDF_MAX_BYTES", str(20 * 1024 * 1024)))
+        )
+        # PDFのテキスト抽出(pypdf)はCPU処理なので別プロセスで行う
+        # ワーカースレッドから fork しないよう spawn で起動する
+        self.extract_processes = int(os.environ.get("PDF_EXTRACT_PROCESSES", "2"))
+        self.extract_pool = self._create_extract_pool()
+        self._extract_pool_lock = threading.Lock()
+        self.extract_timeout = int(os.environ.get("PDF_EXTRACT_TIMEOUT", "120"))
+        self.extract_max_pages = int(os.environ.get("PDF_EXTRACT_MAX_PAGES", "3"))
+        # 決算短信のサマリー表から増減率を読み取れたとき、要約もGeminiを呼ばずに数値から作る (決算発表の集中日向け)
+        self.earnings_skip_llm = os.environ.get("EARNINGS_SKIP_LLM", "false").lower() == "true"
+        # プロンプトに入れる本文の上限 (推定トークン数)。超えた分はカテゴリに関係の薄い行から削る
+        self.prompt_token_budget = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+        # LONG_DOC_PAGES ページを超える文書 (決算短信以外) は、全体を分割して要約してからまとめる
+        self.long_doc_pages = int(os.environ.get("LONG_DOC_PAGES", "6"))
+        self.long_doc_max_pages = int(os.environ.get("LONG_DOC_MAX_PAGES", "60"))
+        self.long_doc_chunk_tokens = int(os.environ.get("LONG_DOC_CHUNK_TOKENS", "6000"))
+        self.long_doc_workers = int(os.environ.get("LONG_DOC_WORKERS", "3"))
 
     def run_analysis_batch(self):
         """
         バッチ処理のメインループ
-        データがなくなるまで処理し続け、なくなってもしばらく待機してから終了する
+        ワーカーを ANALYSIS_WORKERS 個並列に動かし、データがなくなってもしばらく待機してから終了する
         """
-        print("Starting Analysis Batch...")
+        print(f"Starting Analysis Batch... ({self.workers} workers)")
+        self._release_stale_claims()
+        # 保有株数・株価の変化を反映してから、優先度の高い順に分析する
+        refreshed = refresh_pending_priorities()
+        if refreshed:
+            print(f"Refreshed priorities of {refreshed} pending disclosures")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for worker_no in range(self.workers):
+                executor.submit(self._worker_loop, f"{self.worker_id}-{worker_no}")
+        print("Batch finished. Sleeping until next schedule.")
+
+    def _worker_loop(self, worker_name):
         empty_count = 0
         MAX_RETRIES = 30 # 10秒 * 30回 = 5分間データが来なければ終了
 
         while True:
-            # 1. 未処理のデータを1件取得
-            record = self._get_pending_record()
+            # 1. 未処理のデータを1件確保
+            record = self._claim_pending_record(worker_name)
             
             if record:
                 # データがあれば処理実行
-                print(f"Processing: {record.title} ({record.stock_code})")
+                print(f"[{worker_name}] Processing: {record.title} ({record.stock_code})")
+                metrics = AnalysisMetrics(record.id)
                 try:
-                    self._process_single_record(record)
+                    outcome = self._process_single_record(record, metrics)
                 except Exception as e:
                     print(f"Error processing record {record.id}: {e}")
-                    self._update_status(record.id, "ERROR")
+                    self._record_failure(record.id, e)
+                    outcome = "FAILED"
+                metrics.save(outcome)
                 
-                empty_count = 0 # カウントリセット
-                time.sleep(2) # APIレートリミット考慮
+                empty_count = 0 # カウントリセット (APIレートリミットは gemini_limiter で考慮)
             else:
+                # 再試行待ちのレコードがもうすぐ再試行できるなら、終了せずにその時刻まで待つ
+                retry_wait = self._seconds_until_next_retry()
+                if retry_wait is not None and retry_wait <= self.retry_wait_limit:
+                    time.sleep(min(max(retry_wait, 1), 10))
+                    continue
+
                 # データがない場合
                 empty_count += 1
-                print(f"No pending records. Waiting... ({empty_count}/{MAX_RETRIES})")
+                if empty_count == 1 or empty_count % 6 == 0:
+                    print(f"[{worker_name}] No pending records. Waiting... ({empty_count}/{MAX_RETRIES})")
                 
                 if empty_count >= MAX_RETRIES:
-                    print("Batch finished. Sleeping until next schedule.")
                     break
                 time.sleep(10) # 10秒待機
 
-    def _get_pending_record(self):
+    def _claim_pending_record(self, worker_name):
+        """
+        PENDING のレコードを優先度の高い順 (同じなら古い順) に1件確保して IN_PROGRESS にする (再試行待ちで時刻が来ていないものは除く)
+        FOR UPDATE SKIP LOCKED なので、他のワーカーが確保中の行は飛ばして次の行を取る
+        """
+        db: Session = SessionLocal()
+        try:
+            record = db.query(Disclosure).filter(
+                Disclosure.status == "PENDING",
+                or_(Disclosure.next_attempt_at.is_(None), Disclosure.next_attempt_at <= func.now())
+            ).order_by(
+                Disclosure.priority.desc(), Disclosure.created_at.asc()
+            ).with_for_update(skip_locked=True).first()
+            if not record:
+                return None
+            record.status = "IN_PROGRESS"
+            record.claimed_by = worker_name
+            record.claimed_at = func.now()
+            db.flush()
+            # コミット後も title などを参照できるようにセッションから切り離す
+            db.expunge(record)
+            db.commit()
+            return record
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+    def _release_stale_claims(self):
+        """確保したまま一定時間経ったレコード (ワーカー停止など) を PENDING に戻す"""
+        db: Session = SessionLocal()
+        try:
+            released = db.query(Disclosure).filter(
+                Disclosure.status == "IN_PROGRESS",
+                Disclosure.claimed_at < func.now() - timedelta(seconds=self.claim_timeout)
+            ).update({Disclosure.status: "PENDING", Disclosure.claimed_by: None}, synchronize_session=False)
+            db.commit()
+            if released:
+                print(f"Released {released} stale claims")
+        finally:
+            db.close()
+
+    def _seconds_until_next_retry(self):
+        """再試行待ちのレコードのうち、最も早いものまでの秒数 (なければ None)"""
         db: Session = SessionLocal()
         try:
-            # 古いものから順に1件取得
-            return db.query(Disclosure).filter(Disclosure.status == "PENDING").order_by(Disclosure.created_at.asc()).first()
+            wait = db.query(
+                func.min(func.extract("epoch", Disclosure.next_attempt_at - func.now()))
+            ).filter(
+                Disclosure.status == "PENDING",
+                Disclosure.next_attempt_at.isnot(None)
+            ).scalar()
+            return None if wait is None else float(wait)
         finally:
             db.close()
 
@@ -72,15 +211,53 @@ class FinanceAnalyzer:
         finally:
             db.close()
 
-    def _process_single_record(self, record_data):
-        """PDF取得 -> 分析 -> DB更新 -> 通知の一連の流れ"""
+    def _record_failure(self, record_id, error):
+        """
+        失敗したレコードの扱いを決める
+        - 一時的なエラー: 回数が上限未満なら、指数バックオフ後に再試行できるよう PENDING に戻す。上限に達したら DEAD
+        - 恒久的なエラー: 再試行しても同じなので ERROR
+        """
+        transient = is_transient_error(error)
+        db: Session = SessionLocal()
+        try:
+            record = db.query(Disclosure).filter(Disclosure.id == record_id).first()
+            if not record:
+                return
+            record.attempt_count = (record.attempt_count or 0) + 1
+            record.last_error = f"{type(error).__name__}: {error}"[:1000]
+            record.claimed_by = None
+            if not transient:
+                record.status = "ERROR"
+                record.next_attempt_at = None
+            elif record.attempt_count >= self.max_attempts:
+                print(f"Giving up on record {record_id} after {record.attempt_count} attempts")
+                record.status = "DEAD"
+                record.next_attempt_at = None
+            else:
+                delay = backoff_seconds(record.attempt_count, self.retry_base, self.retry_max)
+                print(f"Retrying record {record_id} in {delay:.0f}s (attempt {record.attempt_count}/{self.max_attempts})")
+                record.status = "PENDING"
+                record.next_attempt_at = func.now() + timedelta(seconds=delay)
+            db.commit()
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _process_single_record(self, record_data, metrics=None):
+        """
+        PDF取得 -> 分析 -> DB更新 -> 通知の一連の流れ
+        最終的なステータスを返す (各段階の時間などは metrics に記録する)
+        """
+        metrics = metrics or AnalysisMetrics()
         # DBセッションはここで新規作成（長時間トランザクション回避）
         db: Session = SessionLocal()
         try:
             # 再度インスタンスを取得（デタッチ状態回避のため）
             record = db.query(Disclosure).filter(Disclosure.id == record_data.id).first()
             if not record:
-                return
+                return None
 
             # PDFが取得できない場合の処理
             if not record.pdf_url:
@@ -90,18 +267,23 @@ class FinanceAnalyzer:
                 record.status = "NO_PDF" 
                 record.summary = "PDFを取得できませんでした。"
                 db.commit()
-                return
+                return record.status
             
             # A. PDFダウンロード & テキスト抽出
-            pdf_text = self._extract_text_from_pdf(record.pdf_url)
+            category = record.category or self.classifier.categorize(record.title)
+            metrics.set("analysis_type", self._select_template(category)[0])
+            pdf_text, page_count = self._extract_text_from_pdf(record.pdf_url, category, metrics)
             if not pdf_text:
                 print("Failed to extract text.")
                 record.status = "ERROR"
                 db.commit()
-                return
+                return record.status
 
-            # B. Geminiで分析
-            analysis_result = self._analyze_with_gemini(record.stock_code, record.title, pdf_text)
+            # B. Geminiで分析 (長い文書は分割して要約してからまとめる)
+            if self._is_long_document(category, page_count):
+                analysis_result = self._analyze_long_document(record.stock_code, record.title, record.pdf_url, category, metrics)
+            else:
+                analysis_result = self._analyze_with_gemini(record.stock_code, record.title, pdf_text, category, metrics)
             
             # C. 結果をDBに保存
             if analysis_result:
@@ -109,6 +291,9 @@ class FinanceAnalyzer:
                 record.sales_growth = analysis_result.get("sales_growth", "-")
                 record.profit_growth = analysis_result.get("profit_growth", "-")
                 record.status = "DONE"
+                record.attempt_count = 0
+                record.next_attempt_at = None
+                record.last_error = None
                 
                 # 追加: メール通知
                 subject = f"適時開示分析: {record.stock.stock_name} ({record.title})"
@@ -129,7 +314,9 @@ class FinanceAnalyzer:
             else:
                 record.status = "ERROR"
             
-            db.commit()
+            with metrics.stage("db"):
+                db.commit()
+            return record.status
 
         except Exception as e:
             print(f"Error in _process_single_record: {e}")
@@ -138,60 +325,236 @@ class FinanceAnalyzer:
         finally:
             db.close()
 
-    def _extract_text_from_pdf(self, url):
+    def _extract_text_from_pdf(self, url, category=None, metrics=None):
+        """
+        PDFを取得し、カテゴリに応じて必要なページだけテキストを抽出して (テキスト, 総ページ数) を返す
+        (決算短信ならサマリー、優待なら優待内容のページなど。1ページ目は必ず含む)
+        失敗時の例外はそのまま投げる (再試行するかどうかは呼び出し側でエラーの種類から判断する)
+        """
+        category = category or "other"
+        metrics = metrics or AnalysisMetrics()
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            with io.BytesIO(response.content) as f:
-                reader = PdfReader(f)
-                text = ""
-                # 決算短信のサマリーは通常1ページ目（多くても2ページ目）にあるため
-                # 全ページ読むとトークン消費が激しいので、先頭2ページだけ抽出する
-                max_pages = min(len(reader.pages), 2)
-                for i in range(max_pages):
-                    text += reader.pages[i].extract_text()
-            return text
+            with metrics.stage("download"):
+                sha256, data = self.pdf_cache.fetch(url)
+            metrics.set("download_bytes", len(data))
+            variant = f"target-{category}-{self.extract_max_pages}"
+            text = self.pdf_cache.get_text(sha256, variant)
+            page_count = self.pdf_cache.get_text(sha256, "page-count")
+            if text is not None and page_count is not None:
+                return text, int(page_count)
+
+            with metrics.stage("extract"):
+                text, pages, page_count = self._run_extraction(extract_relevant_text, data, category, self.extract_max_pages)
+            print(f"Extracted pages {pages} / {page_count}: {url}")
+            self.pdf_cache.put_text(sha256, variant, text)
+            self.pdf_cache.put_text(sha256, "page-count", str(page_count))
+            return text, page_count
         except Exception as e:
             print(f"PDF Download Error: {e}")
-            return None
+            raise
+
+    def _create_extract_pool(self):
+        return ProcessPoolExecutor(max_workers=self.extract_processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def _run_extraction(self, fn, *args):
+        """
+        テキスト抽出をプロセスプールで実行し、結果を返す
+        実行中のタスクは取り消せないため、タイムアウトしたらプールのプロセスを終了してプールを作り直す
+        (止まったPDFがプロセスを占有し続けて、抽出全体が止まるのを防ぐ)
+        作り直しに巻き込まれた他のタスクは、新しいプールで1回だけやり直す
+        """
+        for attempt in range(2):
+            with self._extract_pool_lock:
+                pool = self.extract_pool
+            future = pool.submit(fn, *args)
+            try:
+                return future.result(timeout=self.extract_timeout)
+            except TimeoutError:
+                print(f"PDF extraction timed out after {self.extract_timeout}s, restarting extraction processes")
+                self._reset_extract_pool(pool)
+                raise
+            except BrokenProcessPool:
+                self._reset_extract_pool(pool)
+                if attempt:
+                    raise
+
+    def _reset_extract_pool(self, pool):
+        """pool が現在のプールなら新しいプールに差し替え、古いプールのプロセスを終了する"""
+        with self._extract_pool_lock:
+            if self.extract_pool is not pool:
+                return
+            self.extract_pool = self._create_extract_pool()
+        # ProcessPoolExecutor には実行中のプロセスを止める公開APIがないので、プロセスを直接終了する
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _extract_all_pages(self, url, metrics):
+        """長い文書用に、先頭 LONG_DOC_MAX_PAGES ページ分のテキストをページごとに返す"""
+        with metrics.stage("download"):
+            sha256, data = self.pdf_cache.fetch(url)
+        variant = f"full-{self.long_doc_max_pages}"
+        text = self.pdf_cache.get_text(sha256, variant)
+        if text is not None:
+            return text.split("\f")
+
+        with metrics.stage("extract"):
+            pages = self._run_extraction(extract_all_pages, data, self.long_doc_max_pages)
+        # ページ区切りは改ページ文字で保存する
+        self.pdf_cache.put_text(sha256, variant, "\f".join(pages))
+        return pages
+
+    def _is_long_document(self, category, page_count):
+        """分割して要約する長い文書か (決算短信はサマリーのページだけで足りるので対象外)"""
+        return self._select_template(category)[0] != "earnings" and page_count > self.long_doc_pages
+
+    def _split_chunks(self, text):
+        """行単位で、1チャンクの推定トークン数が LONG_DOC_CHUNK_TOKENS 以下になるように分ける"""
+        chunks, lines, size = [], [], 0
+        for line in text.splitlines():
+            tokens = estimate_tokens(line) + 1
+            if lines and size + tokens > self.long_doc_chunk_tokens:
+                chunks.append("\n".join(lines))
+                lines, size = [], 0
+            lines.append(line)
+            size += tokens
+        if lines:
+            chunks.append("\n".join(lines))
+        return chunks
 
-    def _analyze_with_gemini(self, code, title, text):
-        """タイトルに応じてプロンプトを切り替え、Geminiで分析する"""
+    def _analyze_long_document(self, code, title, url, category, metrics):
+        """
+        長い文書の分析 (map-reduce)
+        1. 全ページを整えてチャンクに分け、チャンクごとの要点をGeminiで並列に抽出する (レート制限は共通)
+        2. 要点をつなげたものを、通常どおりカテゴリのプロンプトで分析する
+        チャンクの結果はキャッシュするので、再実行時は内容が変わったチャンクだけ呼び出す
+        """
+        pages = self._extract_all_pages(url, metrics)
+        # 繰り返しのヘッダーなどは文書全体で除く (上限は読み込むページ数分)
+        text, raw_tokens, text_tokens = preprocess_text("\f".join(pages), category, self.long_doc_chunk_tokens * self.long_doc_max_pages)
+        chunks = self._split_chunks(text)
+        metrics.set("chunk_count", len(chunks))
+        print(f"Long document ({len(pages)} pages, {len(chunks)} chunks): {title}")
+
+        with ThreadPoolExecutor(max_workers=self.long_doc_workers) as executor:
+            points = list(executor.map(
+                lambda n: self._summarize_chunk(title, chunks[n], n + 1, len(chunks), metrics), range(len(chunks))
+            ))
+
+        combined = "\n".join(f"[{n}/{len(points)}] {p}" for n, p in enumerate(points, 1))
+        result = self._analyze_with_gemini(code, title, combined, category, metrics)
+        # 前処理の効果は、まとめる前の文書全体で記録する (チャンクと要点の合計を送信量とする)
+        metrics.set("input_tokens_raw", raw_tokens)
+        metrics.set("input_tokens_sent", text_tokens + estimate_tokens(combined))
+        return result
+
+    def _summarize_chunk(self, title, chunk, number, total, metrics):
+        """チャンクの要点を返す (map)。失敗時の例外は呼び出し元に投げる"""
+        text_hash = self.llm_cache.hash_input(title, chunk)
+        cached = self.llm_cache.get("chunk", text_hash)
+        if cached:
+            return cached["summary"]
+
+        prompt = self._create_chunk_prompt(title, chunk, number, total)
+        with metrics.stage("rate_wait"):
+            self.gemini_limiter.acquire()
+        with metrics.stage("llm"):
+            response = self.model.generate_content(prompt, request_options={"timeout": self.gemini_timeout})
+        self._record_usage(response, metrics)
+        result_json = json.loads(response.text.replace("```json", "").replace("```", "").strip())
+        result = {"summary": result_json.get("summary", "")}
+        self.llm_cache.put("chunk", text_hash, result)
+        return result["summary"]
+
+    def _analyze_with_gemini(self, code, title, text, category=None, metrics=None):
+        """開示カテゴリに応じてプロンプトを切り替え、Geminiで分析する"""
+        metrics = metrics or AnalysisMetrics()
         
-        # 1. タイトル判定してプロンプトを作成
-        if "決算短信" in title:
-            prompt = self._create_earnings_prompt(code, title, text)
-            analysis_type = "earnings"
-        elif "株主優待" in title:
-            prompt = self._create_benefits_prompt(code, title, text)
-            analysis_type = "benefits"
+        # 1. クロール時に付与したカテゴリでプロンプトを作成 (未設定ならタイトルから判定)
+        analysis_type = category or self.classifier.categorize(title)
+        template_id, create_prompt = self._select_template(analysis_type)
+
+        # 決算短信はサマリー表から増減率を直接読み取り、Geminiには要約だけを頼む (読み取れなければ従来どおり)
+        figures = parse_earnings_figures(text) if template_id == "earnings" else None
+        if figures:
+            print(f"Parsed earnings figures: {figures}")
+            if self.earnings_skip_llm:
+                metrics.set("analysis_type", "earnings_parsed")
+                return {"summary": self._summarize_figures(figures), **figures}
+            template_id = "earnings_summary"
+            metrics.set("analysis_type", template_id)
+
+        # 表の読み取りは元のテキストで行い、プロンプトには整えたテキストを入れる
+        text = self._prepare_text(text, analysis_type, metrics)
+        if figures:
+            prompt = self._create_earnings_summary_prompt(code, title, text, figures)
         else:
-            # その他の開示（デフォルト）
-            prompt = self._create_default_prompt(code, title, text)
-            analysis_type = "other"
+            prompt = create_prompt(code, title, text)
+
+        # 同じプロンプト(バージョン)・同じ入力で分析済みならAPIを呼ばずに結果を使う
+        text_hash = self.llm_cache.hash_input(code, title, text)
+        cached = self.llm_cache.get(template_id, text_hash)
+        if cached:
+            print(f"LLM cache hit ({template_id}): {title}")
+            metrics.set("llm_cache_hit", True)
+            return cached
 
         try:
-            response = self.model.generate_content(prompt)
+            # 全ワーカー共通のレート制限の範囲内で呼び出す
+            with metrics.stage("rate_wait"):
+                self.gemini_limiter.acquire()
+            with metrics.stage("llm"):
+                response = self.model.generate_content(prompt, request_options={"timeout": self.gemini_timeout})
+            self._record_usage(response, metrics)
             cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
             result_json = json.loads(cleaned_text)
 
             # 2. 結果の正規化
             # どのプロンプトを使ってもDBに入れられる形（辞書）に整える
-            return {
+            result = {
                 "summary": result_json.get("summary", "要約できませんでした"),
                 # 決算以外は "-" をデフォルト値にする
                 "sales_growth": result_json.get("sales_growth", "-"),
                 "profit_growth": result_json.get("profit_growth", "-")
             }
+            # 表から読み取った数値を優先する
+            if figures:
+                result.update(figures)
+            self.llm_cache.put(template_id, text_hash, result)
+            return result
 
         except Exception as e:
             print(f"Gemini API Error ({analysis_type}): {e}")
-            # エラー時もNoneではなくエラーメッセージ入り辞書を返すとDB更新しやすい（お好みで）
-            return None
+            # 429/503 や JSON の崩れは再試行、それ以外は ERROR (_record_failure で判定)
+            raise
+
+    def _prepare_text(self, text, category, metrics=None):
+        """空白・ヘッダー・定型文を除いて予算内に収め、前後の推定トークン数を記録する"""
+        text, before, after = preprocess_text(text, category, self.prompt_token_budget)
+        if metrics:
+            metrics.set("input_tokens_raw", before)
+            metrics.set("input_tokens_sent", after)
+        return text
+
+    @staticmethod
+    def _record_usage(response, metrics):
+        """レスポンスのトークン数を記録する (usage_metadata がない場合は記録しない)"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            metrics.add("prompt_tokens", getattr(usage, "prompt_token_count", None))
+            metrics.add("response_tokens", getattr(usage, "candidates_token_count", None))
 
 # --- 以下、プロンプト生成用メソッド ---
 
+    def _select_template(self, category):
+        """カテゴリに対応するプロンプトの (種類, 生成メソッド) を返す"""
+        if category == CATEGORY_EARNINGS:
+            return "earnings", self._create_earnings_prompt
+        if category == CATEGORY_BENEFITS:
+            return "benefits", self._create_benefits_prompt
+        # その他の開示（デフォルト）
+        return "default", self._create_default_prompt
+
     def _create_earnings_prompt(self, code, title, text):
         """決算短信用のプロンプト"""
         return f"""
@@ -210,6 +573,42 @@ class FinanceAnalyzer:
         {text}
         """
 
+    def _create_earnings_summary_prompt(self, code, title, text, figures):
+        """決算短信用のプロンプト (増減率は読み取り済みなので要約だけ)"""
+        return f"""
+        あなたは証券アナリストです。以下の「決算短信」の内容を要約してください。
+        
+        対象銘柄: {code}
+        タイトル: {title}
+        売上高の増減率: {figures["sales_growth"]}
+        親会社株主に帰属する当期純利益の増減率: {figures["profit_growth"]}
+        
+        以下の情報を、JSON形式でのみ出力してください。
+        
+        1. summary: 開示内容の要約（200文字以内。増収増益などの業績変化や、配当の変更点など核心部分）
+        
+        テキスト:
+        {text}
+        """
+
+    @staticmethod
+    def _summarize_figures(figures):
+        """Geminiを使わない場合の要約 (増減率のみ)"""
+        return f"売上高 {figures['sales_growth']}、親会社株主に帰属する当期純利益 {figures['profit_growth']} (決算短信サマリーより自動抽出)"
+
+    def _create_chunk_prompt(self, title, text, number, total):
+        """長い文書の一部から要点を抜き出すプロンプト (map)"""
+        return f"""
+        あなたは証券アナリストです。以下は開示資料「{title}」を分割したものの一部 ({total}分割中 {number}番目) です。
+        
+        投資家にとって重要な事実（数値・日付・条件・変更点・今後の見通し）を漏らさず抜き出し、JSON形式でのみ出力してください。
+        
+        1. summary: この部分の要点（300文字以内の箇条書き）。重要な記載がなければ空文字
+        
+        テキスト:
+        {text}
+        """
+
     def _create_benefits_prompt(self, code, title, text):
         """株主優待用のプロンプト"""
         return f"""
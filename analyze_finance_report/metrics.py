@@ -0,0 +1,50 @@
+import time
+import threading
+from contextlib import contextmanager
+from common.database import SessionLocal
+from common.models import AnalysisMetric
+
+class AnalysisMetrics:
+    """
+    1レコード分の計測値 (各段階の時間・バイト数・トークン数) を集め、最後に analysis_metrics へ1行書き込む
+    時間は ミリ秒 で、同じ段階を複数回通った場合は合計する
+    """
+    def __init__(self, disclosure_id=None):
+        self.disclosure_id = disclosure_id
+        self.values = {}
+        self._started = time.perf_counter()
+        # 長い文書の分割要約では複数スレッドから加算する
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """with metrics.stage("download"): ... の処理時間を download_ms に加算する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}_ms", (time.perf_counter() - start) * 1000)
+
+    def add(self, key, value):
+        if value is not None:
+            with self._lock:
+                self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def save(self, outcome):
+        """計測を終えて書き込む (計測用のテーブルなので、失敗しても分析処理には影響させない)"""
+        if self.disclosure_id is None:
+            return
+        self.values["total_ms"] = (time.perf_counter() - self._started) * 1000
+        row = {k: int(v) if isinstance(v, float) else v for k, v in self.values.items()}
+        db = SessionLocal()
+        try:
+            db.add(AnalysisMetric(disclosure_id=self.disclosure_id, outcome=outcome, **row))
+            db.commit()
+        except Exception as e:
+            print(f"Failed to save metrics: {e}")
+            db.rollback()
+        finally:
+            db.close()
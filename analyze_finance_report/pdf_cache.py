@@ -0,0 +1,169 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import requests
+
+class PdfCache:
+    """
+    PDFのローカルキャッシュ (内容のSHA-256をキーにした保存)
+    - 同じURLは TTL 秒以内なら通信せずに返し、それ以降は ETag / Last-Modified で再検証する (304なら再取得しない)
+    - 別URL・別タイトルでも内容が同じPDFは1つだけ保存し、抽出済みテキストも共有する
+    - 合計サイズが max_bytes を超えたら、最後に使ってから最も時間が経ったPDFから削除する
+    """
+    def __init__(self, cache_dir, max_bytes, ttl_seconds, timeout=10, max_download_bytes=20 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # 1ファイルのダウンロード上限 (これを超えるPDFは途中で打ち切る)
+        self.max_download_bytes = max_download_bytes
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS texts (
+                sha256 TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (sha256, variant)
+            );
+            CREATE INDEX IF NOT EXISTS ix_blobs_last_access ON blobs (last_access);
+        """)
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.cache_dir, "blobs", sha256[:2], sha256 + ".pdf")
+
+    def fetch(self, url):
+        """
+        PDFを (sha256, バイト列) で返す。キャッシュになければダウンロードする
+        ダウンロードに失敗してもキャッシュがあればそれを返す
+        """
+        with self._lock:
+            row = self._db.execute("SELECT sha256, etag, last_modified, checked_at FROM urls WHERE url = ?", (url,)).fetchone()
+        cached = self._read_blob(row[0]) if row else None
+
+        # TTL内なら再検証しない
+        if cached is not None and time.time() - row[3] < self.ttl_seconds:
+            self._touch(row[0])
+            return row[0], cached
+
+        headers = {}
+        if cached is not None:
+            if row[1]:
+                headers["If-None-Match"] = row[1]
+            if row[2]:
+                headers["If-Modified-Since"] = row[2]
+        try:
+            with requests.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304 and cached is not None:
+                    with self._lock:
+                        self._db.execute("UPDATE urls SET checked_at = ? WHERE url = ?", (time.time(), url))
+                        self._db.commit()
+                    self._touch(row[0])
+                    return row[0], cached
+                response.raise_for_status()
+                data = self._read_capped(response)
+        except requests.RequestException:
+            if cached is not None:
+                print(f"Using cached PDF (revalidation failed): {url}")
+                return row[0], cached
+            raise
+
+        sha256 = self.store(data)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256, etag, last_modified, checked_at) VALUES (?, ?, ?, ?, ?)",
+                (url, sha256, response.headers.get("ETag"), response.headers.get("Last-Modified"), time.time())
+            )
+            self._db.commit()
+        self._evict()
+        return sha256, data
+
+    def _read_capped(self, response):
+        """レスポンスを少しずつ読み、上限を超えたら読むのをやめて ValueError にする"""
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_download_bytes:
+            raise ValueError(f"PDF too large: {content_length} bytes")
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            received += len(chunk)
+            if received > self.max_download_bytes:
+                raise ValueError(f"PDF too large: over {self.max_download_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def store(self, data):
+        """PDFを保存してsha256を返す (同じ内容が保存済みなら書き込まない)"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs (sha256, size, last_access) VALUES (?, ?, ?)",
+                (sha256, len(data), time.time())
+            )
+            self._db.commit()
+        return sha256
+
+    def _read_blob(self, sha256):
+        try:
+            with open(self._blob_path(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _touch(self, sha256):
+        with self._lock:
+            self._db.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._db.commit()
+
+    def _evict(self):
+        """合計サイズが上限以下になるまで、古いものから削除する"""
+        with self._lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for sha256, size in self._db.execute("SELECT sha256, size FROM blobs ORDER BY last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+                self._db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                self._db.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+                self._db.execute("DELETE FROM texts WHERE sha256 = ?", (sha256,))
+                total -= size
+            self._db.commit()
+
+    def get_text(self, sha256, variant):
+        """抽出済みテキストを返す。variant は抽出方法 (対象ページなど) の識別子"""
+        with self._lock:
+            row = self._db.execute("SELECT text FROM texts WHERE sha256 = ? AND variant = ?", (sha256, variant)).fetchone()
+        return row[0] if row else None
+
+    def put_text(self, sha256, variant, text):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO texts (sha256, variant, text) VALUES (?, ?, ?)", (sha256, variant, text))
+            self._db.commit()
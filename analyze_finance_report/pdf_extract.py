@@ -0,0 +1,80 @@
+import io
+from pypdf import PdfReader
+from common.classifier import CATEGORY_EARNINGS, CATEGORY_BENEFITS, CATEGORY_DIVIDEND_REVISION
+
+# カテゴリごとに、分析に必要な情報が載っているページの目印
+PAGE_SIGNALS = {
+    CATEGORY_EARNINGS: ["連結経営成績", "経営成績", "売上高", "親会社株主に帰属する", "業績予想"],
+    CATEGORY_BENEFITS: ["株主優待", "優待内容", "優待の内容", "対象となる株主", "贈呈", "基準日"],
+    CATEGORY_DIVIDEND_REVISION: ["配当予想", "年間配当金", "1株当たり配当金", "修正の理由", "配当の状況"],
+}
+DEFAULT_SIGNALS = ["概要", "内容", "理由", "今後の見通し", "業績への影響"]
+
+# このスコア以上のページが必要な数だけ見つかったら、残りのページは抽出しない
+STRONG_PAGE_SCORE = 3
+
+def extract_relevant_text(data, category, max_pages=3, scan_pages=15):
+    """
+    PDFから分析に使うページのテキストを抽出する (ProcessPoolExecutor から呼ぶのでモジュール関数にしている)
+    1ページ目は必ず含め、残りはカテゴリの目印を多く含むページを選ぶ
+    - しおり (アウトライン) があれば見出しで選ぶ (本文の抽出は選んだページだけ)
+    - なければ先頭 scan_pages ページを順に抽出して採点し、十分なページが見つかった時点で打ち切る (抽出したテキストはそのまま使う)
+    戻り値: (テキスト, 選んだページ番号のリスト(1始まり), 総ページ数)
+    """
+    reader = PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    if page_count == 0:
+        return "", [], 0
+    signals = PAGE_SIGNALS.get(category, DEFAULT_SIGNALS)
+
+    texts = {0: reader.pages[0].extract_text() or ""}
+    selected = _outline_pages(reader, signals)[:max_pages - 1]
+    if not selected:
+        scores = []
+        for i in range(1, min(page_count, scan_pages)):
+            texts[i] = reader.pages[i].extract_text() or ""
+            score = sum(texts[i].count(signal) for signal in signals)
+            if score:
+                scores.append((score, i))
+            if sum(1 for s, _ in scores if s >= STRONG_PAGE_SCORE) >= max_pages - 1:
+                break
+        # 目印がどのページにもなければ、従来どおり先頭ページから
+        if scores:
+            selected = [i for _, i in sorted(scores, key=lambda s: (-s[0], s[1]))[:max_pages - 1]]
+        else:
+            selected = list(range(1, min(page_count, max_pages)))
+    pages = sorted({0, *selected})
+    for i in pages:
+        if i not in texts:
+            texts[i] = reader.pages[i].extract_text() or ""
+    # ページの区切りは改ページ文字 (前処理でページ先頭・末尾のヘッダー・ページ番号を判定する)
+    return "\f".join(texts[i] for i in pages), [i + 1 for i in pages], page_count
+
+def _outline_pages(reader, signals):
+    """しおりの見出しに目印を含むページ (0始まり, 1ページ目を除く) をスコアの高い順に返す。しおりがなければ空"""
+    scores = {}
+
+    def walk(items):
+        for item in items:
+            if isinstance(item, list):
+                walk(item)
+                continue
+            score = sum((item.title or "").count(signal) for signal in signals)
+            if not score:
+                continue
+            page = reader.get_destination_page_number(item)
+            if page:
+                scores[page] = scores.get(page, 0) + score
+
+    try:
+        walk(reader.outline)
+    except Exception as e:
+        # 壊れたしおりは無視して本文で選ぶ
+        print(f"Failed to read PDF outline: {e}")
+        return []
+    return sorted(scores, key=lambda i: (-scores[i], i))
+
+def extract_all_pages(data, max_pages):
+    """長い文書の分割要約用に、先頭から max_pages ページまでのテキストをページごとに抽出する"""
+    reader = PdfReader(io.BytesIO(data))
+    return [page.extract_text() or "" for page in reader.pages[:max_pages]]
@@ -0,0 +1,43 @@
+import time
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from common.database import engine
+from common.models import RateLimitBucket
+
+class DbRateLimiter:
+    """
+    DB上のトークンバケットによるレート制限
+    同じ name を使うすべてのスレッド・コンテナで、呼び出し回数の合計を rate_per_minute 以内に抑える
+    """
+    def __init__(self, name, rate_per_minute, burst=1):
+        self.name = name
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        with engine.begin() as conn:
+            conn.execute(insert(RateLimitBucket).values(name=name, tokens=float(self.burst)).on_conflict_do_nothing())
+
+    def try_acquire(self):
+        """
+        経過時間分のトークンを補充し、1つ以上あれば1つ消費して True を返す
+        補充と消費を1つのUPDATEで行うので、同時に呼ばれても二重に消費されない
+        """
+        with engine.begin() as conn:
+            row = conn.execute(text("""
+                UPDATE rate_limit_buckets
+                SET tokens = LEAST(:burst, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * :rate) - 1,
+                    updated_at = clock_timestamp()
+                WHERE name = :name
+                  AND LEAST(:burst, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * :rate) >= 1
+                RETURNING tokens
+            """), {"name": self.name, "burst": self.burst, "rate": self.rate_per_second}).first()
+        return row is not None
+
+    def acquire(self, timeout=None):
+        """トークンが取れるまで待つ。timeout 秒を過ぎたら False"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while not self.try_acquire():
+            if deadline and time.monotonic() >= deadline:
+                return False
+            # トークン1つが補充されるまでの目安だけ待つ
+            time.sleep(min(1.0 / self.rate_per_second, 5.0))
+        return True
@@ -0,0 +1,325 @@
+import os
+import json
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+from common.database import SessionLocal
+from common.models import Disclosure, ReanalysisJob
+from main import FinanceAnalyzer
+from metrics import AnalysisMetrics
+from earnings_parser import parse_earnings_figures
+from text_preprocess import estimate_tokens
+
+class BulkReanalyzer:
+    """
+    過去の開示をまとめて再分析する
+    - 条件 (期間・カテゴリ・ステータス・銘柄) で対象を選び、ID順に少しずつ処理する
+    - 通常の分析と同じ経路を使う: 長い文書は分割要約、サマリー表を読み取れた決算短信は要約専用のプロンプト (1件ずつ)
+    - それ以外の1回で分析できる開示は、同じプロンプト種類ごとにトークン予算の範囲で1回のリクエストにまとめて分析する
+    - ページごとに結果を一括で書き戻し、処理済みの最大IDを ReanalysisJob に記録する (中断しても続きから)
+    - 抽出・分析に失敗した開示のIDはジョブに記録し、--retry-skipped で取り直す
+    ※ google-generativeai 0.8.5 には Batch API がないため、複数文書を1つのプロンプトにまとめて送る
+    """
+    def __init__(self):
+        self.analyzer = FinanceAnalyzer()
+        # 1リクエストに含める本文の合計推定トークン数 (text_preprocess.estimate_tokens) と最大件数
+        self.token_budget = int(os.environ.get("REANALYZE_TOKEN_BUDGET", "60000"))
+        self.max_docs = int(os.environ.get("REANALYZE_MAX_DOCS", "10"))
+        self.page_size = int(os.environ.get("REANALYZE_PAGE_SIZE", "100"))
+
+    def run(self, job_name, filters):
+        job_id, last_id = self._start_job(job_name, filters)
+        while True:
+            records = self._select_page(filters, last_id)
+            if not records:
+                break
+            results = self._analyze_page(records)
+            self._write_back(results)
+            last_id = records[-1]["id"]
+            skipped = [r["id"] for r in records if r["id"] not in results]
+            self._checkpoint(job_id, last_id, len(results), skipped)
+            print(f"Reanalyzed {len(results)}/{len(records)} disclosures (up to id {last_id})")
+        skipped_count = self._finish_job(job_id)
+        print(f"Reanalysis job '{job_name}' completed ({skipped_count} disclosures skipped, rerun with --retry-skipped)")
+
+    def retry_skipped(self, job_name):
+        """ジョブで読み飛ばした開示だけを分析し直す (再び失敗したものは記録に残す)"""
+        db = SessionLocal()
+        try:
+            job = db.query(ReanalysisJob).filter(ReanalysisJob.name == job_name).first()
+            if not job:
+                print(f"Job '{job_name}' not found")
+                return
+            job_id, skipped_ids = job.id, json.loads(job.skipped_ids or "[]")
+        finally:
+            db.close()
+
+        still_skipped = []
+        processed = 0
+        for i in range(0, len(skipped_ids), self.page_size):
+            ids = skipped_ids[i:i + self.page_size]
+            records = self._select_ids(ids)
+            results = self._analyze_page(records)
+            self._write_back(results)
+            processed += len(results)
+            # 削除された開示は対象外にする
+            still_skipped += [r["id"] for r in records if r["id"] not in results]
+        db = SessionLocal()
+        try:
+            db.query(ReanalysisJob).filter(ReanalysisJob.id == job_id).update({
+                ReanalysisJob.skipped_ids: json.dumps(still_skipped),
+                ReanalysisJob.processed_count: ReanalysisJob.processed_count + processed
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        print(f"Retried {len(skipped_ids)} skipped disclosures: {processed} reanalyzed, {len(still_skipped)} still skipped")
+
+    def _start_job(self, job_name, filters):
+        db = SessionLocal()
+        try:
+            job = db.query(ReanalysisJob).filter(ReanalysisJob.name == job_name).first()
+            if job:
+                print(f"Resuming job '{job_name}' from id {job.last_disclosure_id}")
+                job.status = "RUNNING"
+            else:
+                job = ReanalysisJob(name=job_name, filters=json.dumps(filters, ensure_ascii=False), last_disclosure_id=0, processed_count=0)
+                db.add(job)
+            db.commit()
+            return job.id, job.last_disclosure_id or 0
+        finally:
+            db.close()
+
+    def _checkpoint(self, job_id, last_id, processed, skipped):
+        db = SessionLocal()
+        try:
+            job = db.query(ReanalysisJob).filter(ReanalysisJob.id == job_id).first()
+            job.last_disclosure_id = last_id
+            job.processed_count = (job.processed_count or 0) + processed
+            if skipped:
+                job.skipped_ids = json.dumps(json.loads(job.skipped_ids or "[]") + skipped)
+            db.commit()
+        finally:
+            db.close()
+
+    def _finish_job(self, job_id):
+        """ジョブを完了にし、読み飛ばした件数を返す"""
+        db = SessionLocal()
+        try:
+            job = db.query(ReanalysisJob).filter(ReanalysisJob.id == job_id).first()
+            job.status = "DONE"
+            db.commit()
+            return len(json.loads(job.skipped_ids or "[]"))
+        finally:
+            db.close()
+
+    def _select_page(self, filters, last_id):
+        db = SessionLocal()
+        try:
+            query = db.query(Disclosure).filter(Disclosure.pdf_url.isnot(None))
+            if filters.get("date_from"):
+                query = query.filter(Disclosure.announce_date >= filters["date_from"])
+            if filters.get("date_to"):
+                query = query.filter(Disclosure.announce_date < datetime.date.fromisoformat(filters["date_to"]) + datetime.timedelta(days=1))
+            if filters.get("statuses"):
+                query = query.filter(Disclosure.status.in_(filters["statuses"]))
+            if filters.get("codes"):
+                query = query.filter(Disclosure.stock_code.in_(filters["codes"]))
+            while True:
+                records = query.filter(Disclosure.id > last_id).order_by(Disclosure.id.asc()).limit(self.page_size).all()
+                if not records:
+                    return []
+                # カテゴリ未設定の古いレコードもあるので、カテゴリはPython側で判定して絞り込む
+                rows = [
+                    row for row in map(self._to_record, records)
+                    if not filters.get("categories") or row["category"] in filters["categories"]
+                ]
+                if rows:
+                    return rows
+                # 全件が対象外のページは読み飛ばす
+                last_id = records[-1].id
+        finally:
+            db.close()
+
+    def _select_ids(self, ids):
+        db = SessionLocal()
+        try:
+            records = db.query(Disclosure).filter(Disclosure.id.in_(ids), Disclosure.pdf_url.isnot(None)).order_by(Disclosure.id.asc()).all()
+            return [self._to_record(r) for r in records]
+        finally:
+            db.close()
+
+    def _to_record(self, r):
+        category = r.category or self.analyzer.classifier.categorize(r.title)
+        return {"id": r.id, "stock_code": r.stock_code, "title": r.title, "pdf_url": r.pdf_url, "category": category}
+
+    def _analyze_page(self, records):
+        """ページ内の開示を分析し、{id: 結果} を返す"""
+        with ThreadPoolExecutor(max_workers=self.analyzer.workers) as executor:
+            extracted = list(executor.map(self._extract_text, records))
+
+        results = {}
+        pending = {}
+        individual = []
+        for record, (text, page_count) in zip(records, extracted):
+            if not text:
+                continue
+            template_id, _ = self.analyzer._select_template(record["category"])
+            # 長い文書・読み取れた決算短信は FinanceAnalyzer と同じ処理で1件ずつ分析する
+            if self.analyzer._is_long_document(record["category"], page_count) or (
+                template_id == "earnings" and parse_earnings_figures(text)
+            ):
+                record["text"], record["page_count"] = text, page_count
+                individual.append(record)
+                continue
+            record["text"] = self.analyzer._prepare_text(text, record["category"])
+            # main.py (_analyze_with_gemini) と同じく、前処理後の本文でキャッシュキーを作る
+            record["text_hash"] = self.analyzer.llm_cache.hash_input(record["stock_code"], record["title"], record["text"])
+            cached = self.analyzer.llm_cache.get(template_id, record["text_hash"])
+            if cached:
+                results[record["id"]] = cached
+            else:
+                pending.setdefault(template_id, []).append(record)
+
+        with ThreadPoolExecutor(max_workers=self.analyzer.workers) as executor:
+            for record, result in zip(individual, executor.map(self._analyze_single, individual)):
+                if result:
+                    results[record["id"]] = result
+
+        for template_id, docs in pending.items():
+            for batch in self._pack(docs):
+                results.update(self._analyze_batch(template_id, batch))
+        return results
+
+    def _analyze_single(self, record):
+        """まとめて送れない開示を通常の分析と同じ経路で分析する。失敗したら None (読み飛ばしとして記録される)"""
+        try:
+            if self.analyzer._is_long_document(record["category"], record["page_count"]):
+                return self.analyzer._analyze_long_document(
+                    record["stock_code"], record["title"], record["pdf_url"], record["category"], AnalysisMetrics()
+                )
+            return self.analyzer._analyze_with_gemini(record["stock_code"], record["title"], record["text"], record["category"])
+        except Exception as e:
+            print(f"Reanalysis failed for {record['id']}: {e}")
+            return None
+
+    def _extract_text(self, record):
+        """(テキスト, 総ページ数) を返す。取得・抽出に失敗した開示は今回の再分析から外す (ステータスは変更しない)"""
+        try:
+            return self.analyzer._extract_text_from_pdf(record["pdf_url"], record["category"])
+        except Exception:
+            return None, 0
+
+    def _pack(self, docs):
+        """本文の合計 (推定トークン数) がトークン予算・件数上限に収まるようにまとめる"""
+        batch, size = [], 0
+        for doc in docs:
+            tokens = estimate_tokens(doc["text"])
+            if batch and (size + tokens > self.token_budget or len(batch) >= self.max_docs):
+                yield batch
+                batch, size = [], 0
+            batch.append(doc)
+            size += tokens
+        if batch:
+            yield batch
+
+    def _create_batch_prompt(self, template_id, docs):
+        """既存プロンプトの指示部分を1回だけ使い、複数文書をIDつきで並べる"""
+        _, create_prompt = self.analyzer._select_template(docs[0]["category"])
+        instruction = create_prompt("(各文書を参照)", "(各文書を参照)", "(以下の各文書)")
+        documents = "\n".join(
+            f"""
+        ===== 文書 id={doc['id']} =====
+        対象銘柄: {doc['stock_code']}
+        タイトル: {doc['title']}
+        {doc['text']}
+        """ for doc in docs
+        )
+        return f"""
+        以下の指示を、{len(docs)} 件の文書それぞれに適用してください。
+        出力は、各文書の結果に "id" を加えたJSONオブジェクトの配列のみとしてください。
+        {instruction}
+        {documents}
+        """
+
+    def _analyze_batch(self, template_id, docs):
+        prompt = self._create_batch_prompt(template_id, docs)
+        try:
+            self.analyzer.gemini_limiter.acquire()
+            response = self.analyzer.model.generate_content(
+                prompt,
+                generation_config={"response_mime_type": "application/json"},
+                request_options={"timeout": self.analyzer.gemini_timeout * 2}
+            )
+            items = json.loads(response.text.replace("```json", "").replace("```", "").strip())
+        except Exception as e:
+            print(f"Gemini API Error (batch {template_id}, {len(docs)} docs): {e}")
+            return {}
+
+        docs_by_id = {doc["id"]: doc for doc in docs}
+        results = {}
+        for item in items if isinstance(items, list) else []:
+            try:
+                doc = docs_by_id.get(int(item.get("id")))
+            except (TypeError, ValueError):
+                doc = None
+            if not doc:
+                continue
+            result = {
+                "summary": item.get("summary", "要約できませんでした"),
+                "sales_growth": item.get("sales_growth", "-"),
+                "profit_growth": item.get("profit_growth", "-")
+            }
+            self.analyzer.llm_cache.put(template_id, doc["text_hash"], result)
+            results[doc["id"]] = result
+        missing = len(docs) - len(results)
+        if missing:
+            print(f"{missing} documents missing in batch response ({template_id})")
+        return results
+
+    def _write_back(self, results):
+        """主キー指定の一括UPDATEで書き戻す"""
+        if not results:
+            return
+        db = SessionLocal()
+        try:
+            db.execute(update(Disclosure), [
+                {
+                    "id": record_id, "summary": r["summary"], "sales_growth": r["sales_growth"], "profit_growth": r["profit_growth"],
+                    # 通常の分析の成功時と同じく、再試行の記録を消す
+                    "status": "DONE", "attempt_count": 0, "next_attempt_at": None, "last_error": None
+                }
+                for record_id, r in results.items()
+            ])
+            db.commit()
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    # 例: python reanalyze.py --job earnings-v2 --from 2024-01-01 --category earnings --status DONE,ERROR
+    parser = argparse.ArgumentParser(description="Bulk re-analysis of disclosures")
+    parser.add_argument("--job", required=True, help="ジョブ名 (同じ名前で再実行すると続きから再開)")
+    parser.add_argument("--from", dest="date_from", help="開示日の開始 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="開示日の終了 (YYYY-MM-DD)")
+    parser.add_argument("--category", help="カテゴリ (カンマ区切り: earnings,benefits,dividend_revision,other)")
+    parser.add_argument("--status", default="DONE,ERROR", help="対象ステータス (カンマ区切り)")
+    parser.add_argument("--codes", help="銘柄コード (カンマ区切り)")
+    parser.add_argument("--retry-skipped", action="store_true", help="ジョブで読み飛ばした開示だけを再分析する")
+    args = parser.parse_args()
+
+    if args.retry_skipped:
+        BulkReanalyzer().retry_skipped(args.job)
+    else:
+        filters = {
+            "date_from": args.date_from,
+            "date_to": args.date_to,
+            "categories": args.category.split(",") if args.category else None,
+            "statuses": args.status.split(",") if args.status else None,
+            "codes": args.codes.split(",") if args.codes else None,
+        }
+        BulkReanalyzer().run(args.job, filters)
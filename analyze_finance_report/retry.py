@@ -0,0 +1,32 @@
+import json
+import random
+import concurrent.futures
+import requests
+from sqlalchemy.exc import OperationalError
+from google.api_core import exceptions as google_exceptions
+
+# 時間をおけば成功する可能性があるHTTPステータス
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def is_transient_error(error):
+    """
+    再試行で解決しうるエラーか判定する
+    - 一時的: 通信エラー・タイムアウト、429/5xx (Gemini・PDFサーバー)、JSONの崩れた応答、DB接続エラー
+    - 恒久的: 4xx (PDFが存在しない、リクエスト不正など)、PDFが大きすぎる・壊れている、その他の想定外のエラー
+    """
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in TRANSIENT_STATUS_CODES
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code in TRANSIENT_STATUS_CODES
+    if isinstance(error, (google_exceptions.RetryError, concurrent.futures.TimeoutError, TimeoutError)):
+        return True
+    if isinstance(error, (json.JSONDecodeError, OperationalError)):
+        return True
+    return False
+
+def backoff_seconds(attempt, base, cap):
+    """attempt 回目の失敗後の待ち時間 (指数バックオフ。同時に失敗した行が一斉に再試行しないよう 50〜100% の揺らぎを入れる)"""
+    delay = min(cap, base * (2 ** (attempt - 1)))
+    return delay * random.uniform(0.5, 1.0)
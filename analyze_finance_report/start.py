@@ -1,18 +1,24 @@
+import os
 import time
 import schedule
+from datetime import datetime
 from main import FinanceAnalyzer
 
+ANALYZE_INTERVAL_MINUTES = int(os.environ.get("ANALYZE_INTERVAL_MINUTES", "5"))
+ANALYZE_START = os.environ.get("ANALYZE_START", "07:00")
+ANALYZE_END = os.environ.get("ANALYZE_END", "21:30")
+
 if __name__ == "__main__":
     analyzer = FinanceAnalyzer()
 
-    # 平日 19:15 にバッチ開始
-    # search_disclosure (19:10開始) がデータを入れ始めるのを待ってから動く
-    schedule.every().monday.at("19:15").do(analyzer.run_analysis_batch)
-    schedule.every().tuesday.at("19:15").do(analyzer.run_analysis_batch)
-    schedule.every().wednesday.at("19:15").do(analyzer.run_analysis_batch)
-    schedule.every().thursday.at("19:15").do(analyzer.run_analysis_batch)
-    schedule.every().friday.at("19:15").do(analyzer.run_analysis_batch)
-    
+    # search_disclosure が数分おきに差分クロールするので、こちらも数分おきに未処理データを確認する
+    # (run_analysis_batch は未処理データがなくなってしばらくすると終了する)
+    def run_in_business_hours():
+        now = datetime.now()
+        if now.weekday() < 5 and ANALYZE_START <= now.strftime("%H:%M") <= ANALYZE_END:
+            analyzer.run_analysis_batch()
+    schedule.every(ANALYZE_INTERVAL_MINUTES).minutes.do(run_in_business_hours)
+
     # 開発用: 起動時に一度だけチェックを走らせる（テストしたい場合）
     # analyzer.run_analysis_batch()
 
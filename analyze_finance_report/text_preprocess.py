@@ -0,0 +1,125 @@
+import re
+import unicodedata
+from pdf_extract import PAGE_SIGNALS, DEFAULT_SIGNALS
+
+# ページ番号だけの行 (例: "- 2 -", "3/10", "P.4")。表の数値と区別するため、ページの先頭・末尾の行だけに使う
+PAGE_NUMBER_PATTERN = re.compile(r"^(?:-\s*\d{1,3}\s*-|\d{1,3}\s*/\s*\d{1,3}|P\.?\s*\d{1,3})$", re.IGNORECASE)
+# 数字だけのページ番号 (例: "1")。表の数値と見分けられないので、複数ページの同じ位置で番号が増えていく場合だけ除く
+BARE_PAGE_NUMBER_PATTERN = re.compile(r"^\d{1,3}$")
+# 数値だけの行 (表のセル)。ヘッダー・フッターとはみなさない
+NUMERIC_LINE_PATTERN = re.compile(r"^[\d\s,.%△▲+\-]+$")
+# 定型文 (どの開示にも載っていて分析に関係しない注意書き)
+BOILERPLATE_PATTERNS = [
+    "公認会計士又は監査法人の監査の対象外",
+    "将来に関する記述",
+    "業績予想の適切な利用に関する説明",
+    "当社が現在入手している情報",
+    "実際の業績等は様々な要因",
+    "決算補足説明資料の入手方法",
+    "添付資料の目次",
+]
+# 行全体がこれと一致する場合だけ除く (「100株以上」などを消さないよう部分一致にはしない)
+BOILERPLATE_LINES = {"以上", "目次"}
+# ヘッダー・フッターとみなすページ先頭・末尾の行数
+EDGE_LINES = 2
+# この数以上のページの先頭・末尾に出てくる行をヘッダー・フッターとみなす (ページ数が少なければ全ページ)
+REPEATED_EDGE_PAGES = 3
+# 前後の行も残す範囲 (目印を含む行の前後 n 行)
+CONTEXT_LINES = 3
+
+def estimate_tokens(text):
+    """トークン数の目安 (日本語は1文字 ≒ 1トークン、英数字は4文字 ≒ 1トークン)"""
+    ascii_count = sum(1 for c in text if c.isascii())
+    return len(text) - ascii_count + ascii_count // 4
+
+def preprocess_text(text, category, token_budget):
+    """
+    プロンプトに入れる前に本文を整える (ページの区切りは改ページ文字 \\f)
+    1. 全角英数字・記号を半角にそろえ、空白の連続を1つにする
+    2. ページ先頭・末尾のページ番号、複数ページの先頭・末尾に繰り返し出てくる行 (ヘッダー・フッター)、定型文を除く
+       (本文中の行は繰り返しでも除かない。表の数値はセルごとの行になるため)
+    3. token_budget を超える場合は、カテゴリの目印を含む行とその前後を優先して残す (元の順序のまま)
+    戻り値: (整えたテキスト, 処理前の推定トークン数, 処理後の推定トークン数)
+    """
+    if not text:
+        return text, 0, 0
+    before = estimate_tokens(text)
+
+    pages = []
+    for page in unicodedata.normalize("NFKC", text).split("\f"):
+        page_lines = [re.sub(r"\s+", " ", line).strip() for line in page.splitlines()]
+        page_lines = [line for line in page_lines if line]
+        # ページ番号はページの最初か最後の行にだけ出てくる
+        if page_lines and PAGE_NUMBER_PATTERN.match(page_lines[-1]):
+            page_lines.pop()
+        if page_lines and PAGE_NUMBER_PATTERN.match(page_lines[0]):
+            page_lines.pop(0)
+        pages.append(page_lines)
+    _remove_bare_page_numbers(pages)
+
+    repeated = _repeated_edge_lines(pages)
+    lines = []
+    seen_edges = set()
+    for page_lines in pages:
+        for i, line in enumerate(page_lines):
+            if line in BOILERPLATE_LINES or any(pattern in line for pattern in BOILERPLATE_PATTERNS):
+                continue
+            # ヘッダー・フッターは最初の1回だけ残す (社名・表題など)
+            if line in repeated and _is_edge(i, len(page_lines)):
+                if line in seen_edges:
+                    continue
+                seen_edges.add(line)
+            lines.append(line)
+
+    if estimate_tokens("\n".join(lines)) > token_budget:
+        lines = _trim_to_budget(lines, category, token_budget)
+
+    result = "\n".join(lines)
+    return result, before, estimate_tokens(result)
+
+def _is_edge(index, line_count):
+    return index < EDGE_LINES or index >= line_count - EDGE_LINES
+
+def _remove_bare_page_numbers(pages):
+    """各ページの最後 (なければ最初) の行が、2ページ以上で数字だけかつページ順に増えていればページ番号として除く"""
+    for edge in (-1, 0):
+        numbers = [
+            (page_lines, int(page_lines[edge])) for page_lines in pages
+            if page_lines and BARE_PAGE_NUMBER_PATTERN.match(page_lines[edge])
+        ]
+        if len(numbers) >= 2 and all(a[1] < b[1] for a, b in zip(numbers, numbers[1:])):
+            for page_lines, _ in numbers:
+                page_lines.pop(edge)
+            return
+
+def _repeated_edge_lines(pages):
+    """REPEATED_EDGE_PAGES 以上のページで先頭・末尾に出てくる行 (1ページしかなければ空)"""
+    if len(pages) < 2:
+        return set()
+    counts = {}
+    for page_lines in pages:
+        for line in {line for i, line in enumerate(page_lines) if _is_edge(i, len(page_lines))}:
+            counts[line] = counts.get(line, 0) + 1
+    threshold = min(REPEATED_EDGE_PAGES, len(pages))
+    return {line for line, count in counts.items() if count >= threshold and not NUMERIC_LINE_PATTERN.match(line)}
+
+def _trim_to_budget(lines, category, token_budget):
+    """目印を含む行 > その前後の行 > それ以外 の順に、同じ優先度なら先頭に近い行から予算いっぱいまで残す"""
+    signals = PAGE_SIGNALS.get(category, DEFAULT_SIGNALS)
+    priority = [0] * len(lines)
+    for i, line in enumerate(lines):
+        if any(signal in line for signal in signals):
+            for j in range(max(0, i - CONTEXT_LINES), min(len(lines), i + CONTEXT_LINES + 1)):
+                priority[j] = max(priority[j], 1)
+            priority[i] = 2
+
+    kept = set()
+    used = 0
+    for i in sorted(range(len(lines)), key=lambda i: (-priority[i], i)):
+        # 改行の分も数える
+        tokens = estimate_tokens(lines[i]) + 1
+        if used + tokens > token_budget:
+            continue
+        kept.add(i)
+        used += tokens
+    return [line for i, line in enumerate(lines) if i in kept]
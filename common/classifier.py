@@ -0,0 +1,93 @@
+from collections import deque
+
+# 開示カテゴリ (上から順に優先。複数に該当する場合は先に書いたものを採用)
+CATEGORY_EARNINGS = "earnings"                    # 決算短信
+CATEGORY_BENEFITS = "benefits"                    # 株主優待
+CATEGORY_DIVIDEND_REVISION = "dividend_revision"  # 配当予想の修正など
+CATEGORY_OTHER = "other"                          # その他
+
+CATEGORY_KEYWORDS = [
+    (CATEGORY_EARNINGS, ["決算短信"]),
+    (CATEGORY_BENEFITS, ["株主優待"]),
+    (CATEGORY_DIVIDEND_REVISION, ["配当予想の修正", "配当予想修正", "剰余金の配当", "増配", "復配", "無配"]),
+]
+
+
+class KeywordAutomaton:
+    """
+    複数キーワードを1回の走査で検索するAho-Corasickオートマトン
+    タイトルの長さに比例した時間で、含まれるキーワードをすべて見つける
+    """
+    def __init__(self, keywords):
+        self._goto = [{}]      # 状態ごとの遷移 {文字: 次の状態}
+        self._fail = [0]       # 失敗時の遷移先
+        self._output = [set()] # 状態に到達したときに一致しているキーワード
+        for keyword in keywords:
+            self._add(keyword)
+        self._build_fail_links()
+
+    def _add(self, keyword):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].add(keyword)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find_all(self, text):
+        """text に含まれるキーワードの集合を返す"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found |= self._output[state]
+        return found
+
+
+class DisclosureClassifier:
+    """
+    適時開示タイトルの分類器
+    - 検索キーワード(SEARCH_KEYWORD)に該当するか
+    - カテゴリ (earnings / benefits / dividend_revision / other)
+    を1つのオートマトンでまとめて判定する
+    """
+    def __init__(self, search_keywords=None):
+        # SEARCH_KEYWORD はカンマ区切り。未設定なら全件が検索対象
+        self.search_keywords = {k.strip() for k in (search_keywords or "").split(",") if k.strip()}
+        self.keyword_category = {}
+        for category, keywords in CATEGORY_KEYWORDS:
+            for keyword in keywords:
+                self.keyword_category.setdefault(keyword, category)
+        self.category_priority = {category: i for i, (category, _) in enumerate(CATEGORY_KEYWORDS)}
+        self.automaton = KeywordAutomaton(self.search_keywords | set(self.keyword_category))
+
+    def classify(self, title):
+        """(検索キーワードに該当するか, カテゴリ) を返す"""
+        found = self.automaton.find_all(title or "")
+        matched = not self.search_keywords or bool(found & self.search_keywords)
+        categories = [self.keyword_category[k] for k in found if k in self.keyword_category]
+        category = min(categories, key=self.category_priority.get) if categories else CATEGORY_OTHER
+        return matched, category
+
+    def categorize(self, title):
+        return self.classify(title)[1]
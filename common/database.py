@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Docker-composeで設定した環境変数を取得
@@ -21,3 +22,16 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# 複数コンテナ(レプリカ)で同じ処理を二重に実行しないためのロック
+@contextmanager
+def advisory_lock(key):
+    """PostgreSQLのアドバイザリロックを試行し、取得できたかどうかを返す"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
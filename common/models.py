@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, ForeignKey, UniqueConstraint, Boolean, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from common.database import Base
 
 # 1. ユーザー保有株情報
@@ -58,12 +58,21 @@ class Disclosure(Base):
     summary = Column(Text, nullable=True)                                                        # 決算要約
     sales_growth = Column(String(50), nullable=True)                                             # 売上高増減(増収/減収)
     profit_growth = Column(String(50), nullable=True)                                            # 純利益増減(増益/減益)
-    status = Column(String(20), default="PENDING")                                               # AI処理状態
+    status = Column(String(20), default="PENDING")                                               # AI処理状態 (PENDING / IN_PROGRESS / DONE / ERROR / DEAD / NO_PDF)
+    category = Column(String(30), nullable=True)                                                 # 開示カテゴリ (common.classifier)
+    claimed_by = Column(String(100), nullable=True)                                              # 分析中のワーカー
+    claimed_at = Column(DateTime(timezone=True), nullable=True)                                  # 分析開始日時 (古いものは再取得される)
+    attempt_count = Column(Integer, default=0, server_default=text("0"))                         # 一時的なエラーで失敗した回数
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)                             # 次に再試行できる日時 (それまでは確保しない)
+    last_error = Column(Text, nullable=True)                                                     # 直近のエラー内容
+    priority = Column(Float, default=0, server_default=text("0"))                                # 分析の優先度 (common.priority で計算。大きいものから分析する)
     created_at = Column(DateTime(timezone=True), server_default=func.now())                      # 作成日時
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) # 更新日時
     # 重複防止
     __table_args__ = (
         UniqueConstraint('stock_code', 'announce_date', 'title', name='uix_disclosure_unique'),
+        # 分析待ちの取り出し順 (status, 優先度の高い順, 古い順)
+        Index('ix_disclosure_queue', status, priority.desc(), created_at),
     )
     # リレーション
     stock = relationship("Stock", back_populates="disclosures")
@@ -93,4 +102,164 @@ class DailyGroupSnapshot(Base):
     profit = Column(Integer)
     investment = Column(Integer)
     # リレーション
-    asset_snapshot = relationship("DailyAssetSnapshot", back_populates="group_snapshots")
\ No newline at end of file
+    asset_snapshot = relationship("DailyAssetSnapshot", back_populates="group_snapshots")
+
+# 日次更新バッチの実行記録 (チェックポイント)
+class UpdateRun(Base):
+    __tablename__ = "update_runs"
+    id = Column(Integer, primary_key=True, index=True)
+    run_key = Column(String(20), nullable=False, unique=True)                                    # 実行キー (例: "20251215-1800")
+    status = Column(String(20), default="RUNNING")                                               # RUNNING / DONE / ABORTED
+    total_count = Column(Integer, default=0)                                                     # 対象銘柄数
+    processed_count = Column(Integer, default=0)                                                 # コミット済み銘柄数
+    started_at = Column(DateTime(timezone=True), server_default=func.now())                      # 開始日時
+    finished_at = Column(DateTime(timezone=True), nullable=True)                                 # 終了日時
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) # 更新日時
+    # リレーション (1:N) - 1回の実行に銘柄ごとの作業が紐づく
+    tasks = relationship("UpdateTask", back_populates="run", cascade="all, delete-orphan")
+
+
+# 日次更新の銘柄ごとの作業 (複数レプリカでリースを取って分担する)
+class UpdateTask(Base):
+    __tablename__ = "update_tasks"
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("update_runs.id"), nullable=False)                       # 実行ID
+    stock_code = Column(String(10), nullable=False)                                              # 銘柄コード
+    status = Column(String(20), default="PENDING")                                               # PENDING / CLAIMED / DONE / FAILED / SKIPPED (銘柄削除済み)
+    owner = Column(String(100), nullable=True)                                                   # リース保持中のレプリカ
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)                            # リース期限 (過ぎたら他レプリカが再取得)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) # 更新日時
+    __table_args__ = (
+        UniqueConstraint('run_id', 'stock_code', name='uix_update_task_unique'),
+        Index('ix_update_task_run_status', 'run_id', 'status'),
+    )
+    # リレーション
+    run = relationship("UpdateRun", back_populates="tasks")
+
+
+# 全上場銘柄のスクリーニング用指標 (Stockに登録していない銘柄も含む)
+class ScreenerData(Base):
+    __tablename__ = "screener_data"
+    # カラム定義
+    stock_code = Column(String(10), primary_key=True)                                            # 銘柄コード
+    stock_name = Column(String(255))                                                             # 銘柄名
+    market = Column(String(50), nullable=True)                                                   # 市場区分 (プライム等)
+    sector = Column(String(50), nullable=True)                                                   # 33業種区分
+    current_price = Column(Float, nullable=True)                                                 # 現在値(終値)
+    dividend_amount = Column(Float, nullable=True)                                               # 1株あたり配当金(円)
+    dividend_yield = Column(Float, nullable=True)                                                # 配当利回り (%)
+    eps = Column(Float, nullable=True)                                                           # 過去EPS
+    bps = Column(Float, nullable=True)                                                           # 1株あたり純資産
+    per = Column(Float, nullable=True)                                                           # PER
+    pbr = Column(Float, nullable=True)                                                           # PBR
+    mix_coefficient = Column(Float, nullable=True)                                               # ミックス係数 (PER * PBR)
+    payout_ratio = Column(Float, nullable=True)                                                  # 配当性向 (%)
+    is_profitable = Column(Boolean, default=False)                                               # 黒字かどうか (EPS > 0)
+    price_updated_at = Column(DateTime(timezone=True), nullable=True)                            # 株価更新日時
+    fundamentals_updated_at = Column(DateTime(timezone=True), nullable=True)                     # EPS/BPS/配当 更新日時
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) # 更新日時
+    # スクリーニング条件・ソートで使う列にインデックス
+    __table_args__ = (
+        Index('ix_screener_profitable_mix', 'is_profitable', 'mix_coefficient'),
+        Index('ix_screener_dividend_yield', 'dividend_yield'),
+        Index('ix_screener_per', 'per'),
+        Index('ix_screener_pbr', 'pbr'),
+        Index('ix_screener_sector', 'sector'),
+    )
+
+
+# 日次終値の履歴 (リスク分析用。ベンチマークも同じテーブルに保存するためStockとは紐づけない)
+class PriceHistory(Base):
+    __tablename__ = "price_history"
+    id = Column(Integer, primary_key=True, index=True)
+    stock_code = Column(String(10), nullable=False)                                              # 銘柄コード
+    date = Column(Date, nullable=False)                                                          # 日付
+    close = Column(Float, nullable=False)                                                        # 終値 (調整後)
+    __table_args__ = (
+        UniqueConstraint('stock_code', 'date', name='uix_price_history_unique'),
+        Index('ix_price_history_date', 'date'),
+    )
+
+
+# 適時開示クロールの進捗 (日ごとのハイウォーターマーク)
+class CrawlState(Base):
+    __tablename__ = "crawl_states"
+    id = Column(Integer, primary_key=True, index=True)
+    crawl_date = Column(Date, nullable=False, unique=True)                                       # 対象日
+    last_announce_time = Column(String(10), nullable=True)                                       # 取得済みの最新開示時刻 (HH:MM)
+    last_entry_url = Column(String(512), nullable=True)                                          # 取得済みの最新開示のURL
+    entry_count = Column(Integer, default=0)                                                     # 一覧から取得した件数の累計
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) # 更新日時
+
+
+# 過去分の適時開示取得(バックフィル)の進捗 (銘柄 x 日付ごとに完了を記録し、中断しても続きから再開する)
+class BackfillDay(Base):
+    __tablename__ = "backfill_days"
+    id = Column(Integer, primary_key=True, index=True)
+    stock_code = Column(String(10), nullable=False)                                              # 銘柄コード
+    crawl_date = Column(Date, nullable=False)                                                    # 取得済みの日付
+    disclosure_count = Column(Integer, default=0)                                                # その日に見つかった開示件数
+    created_at = Column(DateTime(timezone=True), server_default=func.now())                      # 作成日時
+    __table_args__ = (
+        UniqueConstraint('stock_code', 'crawl_date', name='uix_backfill_day_unique'),
+    )
+
+
+# 外部API呼び出しのトークンバケット (複数ワーカー・コンテナで共有するレート制限)
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+    name = Column(String(50), primary_key=True)                                                  # 対象API (例: "gemini")
+    tokens = Column(Float, nullable=False, default=0.0)                                          # 残りトークン
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())                      # トークン補充の基準時刻
+
+
+# Geminiの分析結果キャッシュ (同じプロンプト・同じ本文なら再度APIを呼ばない)
+class LlmResultCache(Base):
+    __tablename__ = "llm_result_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    template_id = Column(String(30), nullable=False)                                             # プロンプトの種類 (earnings / benefits / default など)
+    template_version = Column(Integer, nullable=False)                                           # プロンプトのバージョン
+    model_name = Column(String(50), nullable=False)                                              # モデル名
+    text_hash = Column(String(64), nullable=False)                                               # プロンプトに埋め込んだ入力のSHA-256
+    result = Column(Text, nullable=False)                                                        # 正規化済みの分析結果 (JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())                      # 作成日時
+    __table_args__ = (
+        UniqueConstraint('template_id', 'template_version', 'model_name', 'text_hash', name='uix_llm_result_cache_key'),
+    )
+
+
+# 一括再分析の進捗 (ID順に処理し、処理済みの最大IDを記録して中断後に再開する)
+class ReanalysisJob(Base):
+    __tablename__ = "reanalysis_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, unique=True)                                      # ジョブ名
+    filters = Column(Text, nullable=True)                                                        # 対象の絞り込み条件 (JSON)
+    status = Column(String(20), default="RUNNING")                                               # RUNNING / DONE
+    last_disclosure_id = Column(Integer, default=0)                                              # 処理済みの最大Disclosure ID
+    processed_count = Column(Integer, default=0)                                                 # 更新済み件数
+    skipped_ids = Column(Text, nullable=True)                                                    # 抽出・分析に失敗して読み飛ばしたDisclosure ID (JSON配列。--retry-skipped で再処理)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())                      # 作成日時
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) # 更新日時
+
+
+# 分析処理の計測値 (1レコードの分析ごとに1行。ボトルネックの把握とトークン使用量の見積もり用)
+class AnalysisMetric(Base):
+    __tablename__ = "analysis_metrics"
+    id = Column(Integer, primary_key=True, index=True)
+    disclosure_id = Column(Integer, nullable=False)                                              # 対象のDisclosure ID (開示の再作成で消えても残すため外部キーにしない)
+    analysis_type = Column(String(30), nullable=True)                                            # プロンプトの種類 (earnings / benefits / default)
+    outcome = Column(String(20), nullable=True)                                                  # 結果 (DONE / ERROR / NO_PDF / FAILED)
+    download_bytes = Column(Integer, nullable=True)                                              # PDFのサイズ
+    download_ms = Column(Integer, nullable=True)                                                 # PDF取得時間 (キャッシュ確認を含む)
+    extract_ms = Column(Integer, nullable=True)                                                  # テキスト抽出時間
+    llm_ms = Column(Integer, nullable=True)                                                      # Gemini呼び出し時間 (レート制限の待ちを含まない)
+    rate_wait_ms = Column(Integer, nullable=True)                                                # レート制限の待ち時間
+    db_ms = Column(Integer, nullable=True)                                                       # 結果の書き込み時間
+    total_ms = Column(Integer, nullable=True)                                                    # 合計時間
+    input_tokens_raw = Column(Integer, nullable=True)                                            # 前処理前の本文の推定トークン数
+    input_tokens_sent = Column(Integer, nullable=True)                                           # 前処理後 (プロンプトに入れた) 本文の推定トークン数
+    prompt_tokens = Column(Integer, nullable=True)                                               # 入力トークン数
+    response_tokens = Column(Integer, nullable=True)                                             # 出力トークン数
+    llm_cache_hit = Column(Boolean, default=False)                                               # 分析結果キャッシュを使ったか
+    chunk_count = Column(Integer, nullable=True)                                                 # 長い文書を分割要約したときのチャンク数
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)          # 記録日時
@@ -0,0 +1,56 @@
+from sqlalchemy import update, select, case, func
+from common.database import SessionLocal
+from common.models import Stock, MarketData, Disclosure
+from common.classifier import CATEGORY_EARNINGS, CATEGORY_BENEFITS, CATEGORY_DIVIDEND_REVISION
+
+# 開示カテゴリごとの重み (決算短信を最優先)
+CATEGORY_WEIGHTS = {
+    CATEGORY_EARNINGS: 30,
+    CATEGORY_DIVIDEND_REVISION: 20,
+    CATEGORY_BENEFITS: 10,
+}
+# 保有中 (保有株数 > 0) の銘柄への加点 (ウォッチのみの銘柄は 0)
+HELD_WEIGHT = 20
+# 保有評価額 (保有株数 x 現在値) の重み: VALUE_WEIGHT * ln(1 + 評価額 / VALUE_UNIT)
+# 例: 100万円 ≒ 23点、1000万円 ≒ 35点 (大きな保有でも他の要素を打ち消しすぎないよう対数にする)
+VALUE_WEIGHT = 5
+VALUE_UNIT = 10000
+
+def priority_expression():
+    """disclosures の優先度を計算するSQL式 (stocks と結合して使う)"""
+    current_price = select(MarketData.current_price).where(
+        MarketData.stock_code == Disclosure.stock_code
+    ).scalar_subquery()
+    holding_value = func.greatest(func.coalesce(Stock.number, 0), 0) * func.coalesce(current_price, 0)
+    category_weight = case(
+        *[(Disclosure.category == category, weight) for category, weight in CATEGORY_WEIGHTS.items()],
+        else_=0
+    )
+    held_weight = case((Stock.number > 0, HELD_WEIGHT), else_=0)
+    return category_weight + held_weight + VALUE_WEIGHT * func.ln(1 + holding_value / VALUE_UNIT)
+
+def refresh_pending_priorities():
+    """
+    未分析 (PENDING) の開示の優先度を、現在の保有株数・株価で計算し直す
+    保有株数や株価は変わるので、登録時だけでなく分析バッチの開始時にも呼ぶ
+    戻り値: 更新した件数
+    """
+    db = SessionLocal()
+    try:
+        priority = priority_expression()
+        result = db.execute(
+            update(Disclosure).where(
+                Disclosure.status == "PENDING",
+                Disclosure.stock_code == Stock.stock_code,
+                # 値が変わる行だけ書き込む
+                Disclosure.priority.is_distinct_from(priority)
+            ).values(priority=priority).execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount
+    except Exception as e:
+        print(f"DB Error: {e}")
+        db.rollback()
+        return 0
+    finally:
+        db.close()
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from common.database import SessionLocal
 from common.models import Stock, Disclosure, MarketData, DailyAssetSnapshot, DailyGroupSnapshot
 from common.database import engine, SessionLocal, Base
+from sqlalchemy import inspect, text
 
 import os
 import csv
@@ -13,6 +14,31 @@ class DbBackuper:
         # DB接続準備
         # テーブルが存在しなければ作成する
         Base.metadata.create_all(bind=engine)
+        # 既存テーブルに後から追加された列・インデックスを反映する
+        self.migrate_schema()
+
+    def migrate_schema(self):
+        """
+        create_all は既存テーブルを変更しないため、モデルに追加された列とインデックスを追加する
+        (列の削除・型変更は行わない)
+        """
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    default = ""
+                    if column.server_default is not None:
+                        default = f" DEFAULT {column.server_default.arg.compile(dialect=engine.dialect)}"
+                    print(f"Adding column: {table.name}.{column.name}")
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}{default}'))
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
 
     def backup(self):
         """
@@ -0,0 +1,168 @@
+import os
+import numpy as np
+from datetime import timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from common.database import SessionLocal
+from common.models import Stock, PriceHistory
+
+TRADING_DAYS = 252 # 年率換算に使う年間営業日数
+
+class PortfolioAnalytics:
+    """
+    保有銘柄の株価履歴を (日付 x 銘柄) の行列に読み込み、リスク指標をNumPyでまとめて計算する
+    結果は最新の株価日付と保有内容が変わるまで (= 営業日ごとに) キャッシュする
+    """
+    def __init__(self):
+        self.benchmark_code = os.environ.get("BENCHMARK_CODE", "1306")
+        self.lookback_days = int(os.environ.get("RISK_LOOKBACK_DAYS", "730"))
+        self.rolling_window = int(os.environ.get("RISK_ROLLING_WINDOW", "20"))
+        self._cache_key = None
+        self._cache_value = None
+
+    def get_risk_report(self):
+        db: Session = SessionLocal()
+        try:
+            holdings = [
+                (s.stock_code, s.stock_name, s.number, s.market_data.current_price, s.group or "未分類", s.market_data.sector or "その他")
+                for s in db.query(Stock).filter(Stock.number > 0).all()
+                if s.market_data and s.market_data.current_price
+            ]
+            if not holdings:
+                return {}
+            latest_date = db.query(func.max(PriceHistory.date)).scalar()
+            if latest_date is None:
+                return {}
+
+            # 営業日と保有内容が同じならキャッシュを返す
+            cache_key = (latest_date, tuple((h[0], h[2]) for h in holdings))
+            if cache_key == self._cache_key:
+                return self._cache_value
+
+            codes = [h[0] for h in holdings]
+            rows = db.query(PriceHistory.stock_code, PriceHistory.date, PriceHistory.close).filter(
+                PriceHistory.stock_code.in_(codes + [self.benchmark_code]),
+                PriceHistory.date >= latest_date - timedelta(days=self.lookback_days)
+            ).all()
+        finally:
+            db.close()
+
+        report = self._compute(holdings, rows)
+        self._cache_key, self._cache_value = cache_key, report
+        return report
+
+    def _build_price_matrix(self, columns, rows):
+        """(銘柄コード, 日付, 終値) のリストから (日付 x 銘柄) の終値行列を作る。欠損は直前値で埋める"""
+        codes = np.array([r[0] for r in rows])
+        dates = np.array([r[1] for r in rows], dtype="datetime64[D]")
+        closes = np.array([r[2] for r in rows], dtype=float)
+
+        unique_dates = np.unique(dates)
+        col_index = {code: i for i, code in enumerate(columns)}
+        row_idx = np.searchsorted(unique_dates, dates)
+        col_idx = np.array([col_index[c] for c in codes])
+
+        prices = np.full((len(unique_dates), len(columns)), np.nan)
+        prices[row_idx, col_idx] = closes
+
+        # 前方埋め: 各セルについて「直近で値がある行番号」を累積maxで求める
+        valid = ~np.isnan(prices)
+        last_valid = np.where(valid, np.arange(len(unique_dates))[:, None], 0)
+        np.maximum.accumulate(last_valid, axis=0, out=last_valid)
+        prices = prices[last_valid, np.arange(len(columns))]
+        return unique_dates, prices
+
+    def _rolling_std(self, returns, window):
+        """累積和を使った移動標準偏差 (窓ごとのループなし)"""
+        csum = np.cumsum(np.vstack([np.zeros((1, returns.shape[1])), returns]), axis=0)
+        csum_sq = np.cumsum(np.vstack([np.zeros((1, returns.shape[1])), returns ** 2]), axis=0)
+        win_sum = csum[window:] - csum[:-window]
+        win_sum_sq = csum_sq[window:] - csum_sq[:-window]
+        variance = (win_sum_sq - win_sum ** 2 / window) / (window - 1)
+        return np.sqrt(np.clip(variance, 0, None))
+
+    def _max_drawdown(self, log_returns):
+        """累積リターンの高値からの下落率の最小値"""
+        wealth = np.exp(np.cumsum(log_returns, axis=0))
+        peak = np.maximum.accumulate(wealth, axis=0)
+        return (wealth / peak - 1).min(axis=0)
+
+    def _compute(self, holdings, rows):
+        codes = [h[0] for h in holdings]
+        columns = codes + [self.benchmark_code]
+        dates, prices = self._build_price_matrix(columns, rows)
+        if len(dates) <= self.rolling_window:
+            return {}
+
+        # 日次対数リターン (上場前など値がない期間は0とみなす)
+        returns = np.nan_to_num(np.diff(np.log(prices), axis=0))
+        stock_returns = returns[:, :len(codes)]
+        bench_returns = returns[:, len(codes)]
+
+        # 現在の時価ウェイト
+        values = np.array([h[2] * h[3] for h in holdings], dtype=float)
+        weights = values / values.sum()
+        port_returns = stock_returns @ weights
+
+        # ボラティリティ (年率)
+        vol = stock_returns.std(axis=0, ddof=1) * np.sqrt(TRADING_DAYS)
+        port_vol = port_returns.std(ddof=1) * np.sqrt(TRADING_DAYS)
+        rolling_port_vol = self._rolling_std(port_returns[:, None], self.rolling_window)[:, 0] * np.sqrt(TRADING_DAYS)
+
+        # 相関行列
+        corr = np.corrcoef(stock_returns, rowvar=False) if len(codes) > 1 else np.ones((1, 1))
+        corr = np.nan_to_num(corr)
+
+        # 最大ドローダウン
+        drawdowns = self._max_drawdown(stock_returns)
+        port_drawdown = self._max_drawdown(port_returns[:, None])[0]
+
+        # ベータ (対ベンチマーク)
+        bench_c = bench_returns - bench_returns.mean()
+        bench_var = bench_c @ bench_c
+        betas = ((stock_returns - stock_returns.mean(axis=0)).T @ bench_c) / bench_var if bench_var > 0 else np.zeros(len(codes))
+        port_beta = float(weights @ betas)
+
+        # リスク寄与度 (w_i * (Σw)_i / w'Σw) をグループ・セクター別に集計
+        cov = np.cov(stock_returns, rowvar=False) * TRADING_DAYS if len(codes) > 1 else np.array([[vol[0] ** 2]])
+        port_var = weights @ cov @ weights
+        contributions = weights * (cov @ weights) / port_var if port_var > 0 else np.zeros(len(codes))
+
+        def aggregate(labels):
+            names, idx = np.unique(np.array(labels), return_inverse=True)
+            return {
+                "labels": names.tolist(),
+                "weight": np.round(np.bincount(idx, weights=weights) * 100, 2).tolist(),
+                "risk_contribution": np.round(np.bincount(idx, weights=contributions) * 100, 2).tolist(),
+            }
+
+        return {
+            "as_of": str(dates[-1]),
+            "portfolio": {
+                "volatility": round(float(port_vol) * 100, 2),
+                "max_drawdown": round(float(port_drawdown) * 100, 2),
+                "beta": round(port_beta, 2),
+            },
+            "stocks": [
+                {
+                    "stock_code": h[0],
+                    "stock_name": h[1],
+                    "weight": round(float(weights[i]) * 100, 2),
+                    "volatility": round(float(vol[i]) * 100, 2),
+                    "max_drawdown": round(float(drawdowns[i]) * 100, 2),
+                    "beta": round(float(betas[i]), 2),
+                    "risk_contribution": round(float(contributions[i]) * 100, 2),
+                }
+                for i, h in enumerate(holdings)
+            ],
+            "correlation": {
+                "labels": codes,
+                "matrix": np.round(corr, 3).tolist(),
+            },
+            "rolling_volatility": {
+                "dates": [str(d) for d in dates[self.rolling_window:]],
+                "values": np.round(rolling_port_vol * 100, 2).tolist(),
+            },
+            "groups": aggregate([h[4] for h in holdings]),
+            "sectors": aggregate([h[5] for h in holdings]),
+        }
@@ -1,8 +1,10 @@
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session
 import os
+from datetime import timedelta
 
 from common.database import engine, SessionLocal, Base
-from common.models import Stock, DailyAssetSnapshot
+from common.models import Stock, DailyAssetSnapshot, ScreenerData, AnalysisMetric
 
 class FrontendClass:
     def __init__(self):
@@ -354,4 +356,157 @@ class FrontendClass:
             print(f"Error getting graph data: {e}")
             return {} # エラー時は空を返す
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+    # スクリーナーで並び替えに使える列
+    SCREENER_SORT_COLUMNS = {
+        "stock_code": ScreenerData.stock_code,
+        "mix_coefficient": ScreenerData.mix_coefficient,
+        "dividend_yield": ScreenerData.dividend_yield,
+        "per": ScreenerData.per,
+        "pbr": ScreenerData.pbr,
+        "payout_ratio": ScreenerData.payout_ratio,
+        "current_price": ScreenerData.current_price,
+    }
+
+    def screen_stocks(self, filters, sort_by="mix_coefficient", order="asc", page=1, per_page=50):
+        """
+        全上場銘柄を条件で絞り込み、ソート・ページングして返す
+        filters: {"max_mix": 22.5, "min_yield": 3.0, "profitable": True, ...} (Noneの条件は無視)
+        """
+        db: Session = SessionLocal()
+        try:
+            query = db.query(ScreenerData)
+            # === 絞り込み (インデックスの効く列に対する条件のみ) ===
+            if filters.get("max_mix") is not None:
+                query = query.filter(ScreenerData.mix_coefficient <= filters["max_mix"])
+            if filters.get("min_yield") is not None:
+                query = query.filter(ScreenerData.dividend_yield >= filters["min_yield"])
+            if filters.get("max_per") is not None:
+                query = query.filter(ScreenerData.per <= filters["max_per"])
+            if filters.get("max_pbr") is not None:
+                query = query.filter(ScreenerData.pbr <= filters["max_pbr"])
+            if filters.get("max_payout") is not None:
+                query = query.filter(ScreenerData.payout_ratio <= filters["max_payout"])
+            if filters.get("profitable"):
+                query = query.filter(ScreenerData.is_profitable == True)
+            if filters.get("sector"):
+                query = query.filter(ScreenerData.sector == filters["sector"])
+
+            total = query.count()
+
+            # === ソート (データなしは常に末尾) ===
+            column = self.SCREENER_SORT_COLUMNS.get(sort_by, ScreenerData.mix_coefficient)
+            column = column.desc() if order == "desc" else column.asc()
+            query = query.order_by(column.nullslast(), ScreenerData.stock_code.asc())
+
+            # === ページング ===
+            page = max(page, 1)
+            records = query.offset((page - 1) * per_page).limit(per_page).all()
+
+            # 登録済み銘柄の判定用
+            registered_codes = {row.stock_code for row in db.query(Stock.stock_code).all()}
+
+            ret_list = [
+                {
+                    "stock_code": r.stock_code,
+                    "stock_name": r.stock_name,
+                    "market": r.market if r.market else "-",
+                    "sector": r.sector if r.sector else "-",
+                    "current_price": r.current_price,
+                    "dividend_yield": r.dividend_yield,
+                    "per": r.per,
+                    "pbr": r.pbr,
+                    "mix_coefficient": r.mix_coefficient,
+                    "payout_ratio": r.payout_ratio,
+                    "is_profitable": r.is_profitable,
+                    "registered": r.stock_code in registered_codes,
+                }
+                for r in records
+            ]
+            return ret_list, total
+        finally:
+            db.close()
+
+    def get_screener_sectors(self):
+        """スクリーナーの業種プルダウン用"""
+        db: Session = SessionLocal()
+        try:
+            rows = db.query(ScreenerData.sector).filter(ScreenerData.sector != None).distinct().order_by(ScreenerData.sector).all()
+            return [row.sector for row in rows]
+        finally:
+            db.close()
+
+    # 分析処理の計測値のうち、パーセンタイルを出す列と表示名
+    METRIC_STAGES = [
+        ("download_ms", "PDF取得"),
+        ("extract_ms", "テキスト抽出"),
+        ("rate_wait_ms", "レート制限待ち"),
+        ("llm_ms", "Gemini"),
+        ("db_ms", "DB書き込み"),
+        ("total_ms", "合計"),
+    ]
+
+    def get_analysis_metrics(self, days=14):
+        """
+        直近 days 日の分析処理の計測値を集計する
+        - stages: 段階ごとの p50 / p95 (ミリ秒) と件数
+        - daily_tokens: 日付 x 分析の種類ごとのトークン数と件数
+        - outcomes: 結果ごとの件数
+        """
+        db: Session = SessionLocal()
+        try:
+            since = func.now() - timedelta(days=days)
+
+            columns = []
+            for key, _ in self.METRIC_STAGES:
+                column = getattr(AnalysisMetric, key)
+                columns += [
+                    func.percentile_cont(0.5).within_group(column.asc()),
+                    func.percentile_cont(0.95).within_group(column.asc()),
+                    func.count(column),
+                ]
+            row = db.query(*columns).filter(AnalysisMetric.created_at >= since).one()
+            stages = [
+                {"key": key, "label": label, "p50": row[i * 3], "p95": row[i * 3 + 1], "count": row[i * 3 + 2]}
+                for i, (key, label) in enumerate(self.METRIC_STAGES)
+            ]
+
+            day = func.date(AnalysisMetric.created_at)
+            rows = db.query(
+                day.label("day"),
+                AnalysisMetric.analysis_type,
+                func.count(AnalysisMetric.id),
+                func.sum(case((AnalysisMetric.llm_cache_hit == True, 1), else_=0)),
+                func.coalesce(func.sum(AnalysisMetric.prompt_tokens), 0),
+                func.coalesce(func.sum(AnalysisMetric.response_tokens), 0),
+                func.coalesce(func.sum(AnalysisMetric.input_tokens_raw), 0),
+                func.coalesce(func.sum(AnalysisMetric.input_tokens_sent), 0),
+            ).filter(
+                AnalysisMetric.created_at >= since
+            ).group_by(day, AnalysisMetric.analysis_type).order_by(day.desc(), AnalysisMetric.analysis_type).all()
+            daily_tokens = [
+                {
+                    "day": r[0],
+                    "analysis_type": r[1] or "-",
+                    "count": r[2],
+                    "cache_hits": r[3],
+                    "prompt_tokens": r[4],
+                    "response_tokens": r[5],
+                    "input_tokens_raw": r[6],
+                    "input_tokens_sent": r[7],
+                }
+                for r in rows
+            ]
+
+            outcomes = db.query(AnalysisMetric.outcome, func.count(AnalysisMetric.id)).filter(
+                AnalysisMetric.created_at >= since
+            ).group_by(AnalysisMetric.outcome).order_by(func.count(AnalysisMetric.id).desc()).all()
+
+            return {
+                "stages": stages,
+                "daily_tokens": daily_tokens,
+                "outcomes": [{"outcome": o or "-", "count": c} for o, c in outcomes],
+            }
+        finally:
+            db.close()
@@ -3,9 +3,11 @@ import os
 import requests
 from bs4 import BeautifulSoup
 from main import FrontendClass
+from analytics import PortfolioAnalytics
 
 app = Flask(__name__)
 frontend_app = FrontendClass() 
+risk_analytics = PortfolioAnalytics()
 
 # Fabicon route
 @app.route('/favicon.ico')
@@ -100,5 +102,67 @@ def get_stock_name(stock_code):
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _get_screener_params(args):
+    """クエリパラメータからスクリーナー条件を取り出す (空欄は条件なし)"""
+    def to_float(key):
+        value = args.get(key)
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+    filters = {
+        "max_mix": to_float("max_mix"),
+        "min_yield": to_float("min_yield"),
+        "max_per": to_float("max_per"),
+        "max_pbr": to_float("max_pbr"),
+        "max_payout": to_float("max_payout"),
+        "profitable": args.get("profitable") == "1",
+        "sector": args.get("sector") or None,
+    }
+    sort_by = args.get("sort", "mix_coefficient")
+    order = args.get("order", "asc")
+    # 0以下はページ数の計算 (ゼロ除算) や LIMIT/OFFSET が壊れるので 1 以上にそろえる
+    page = max(args.get("page", 1, type=int), 1)
+    per_page = max(1, min(args.get("per_page", 50, type=int), 200))
+    return filters, sort_by, order, page, per_page
+
+@app.route("/screener", methods=["GET"])
+def screener():
+    filters, sort_by, order, page, per_page = _get_screener_params(request.args)
+    results, total = frontend_app.screen_stocks(filters, sort_by, order, page, per_page)
+    return render_template(
+        "screener.html",
+        results=results,
+        total=total,
+        filters=filters,
+        sectors=frontend_app.get_screener_sectors(),
+        current_sort=sort_by,
+        current_order=order,
+        page=page,
+        per_page=per_page,
+        last_page=max((total + per_page - 1) // per_page, 1)
+    )
+
+@app.route("/api/screener", methods=["GET"])
+def api_screener():
+    filters, sort_by, order, page, per_page = _get_screener_params(request.args)
+    results, total = frontend_app.screen_stocks(filters, sort_by, order, page, per_page)
+    return jsonify({"status": "success", "total": total, "page": page, "per_page": per_page, "results": results})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """開示分析の処理時間・トークン使用量"""
+    days = min(max(request.args.get("days", 14, type=int), 1), 90)
+    return render_template("metrics.html", metrics=frontend_app.get_analysis_metrics(days), days=days)
+
+@app.route("/api/risk", methods=["GET"])
+def api_risk():
+    """保有銘柄のリスク指標 (ボラティリティ・相関・ドローダウン・ベータ・寄与度)"""
+    try:
+        return jsonify(risk_analytics.get_risk_report())
+    except Exception as e:
+        print(f"Error computing risk report: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0")
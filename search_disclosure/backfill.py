@@ -0,0 +1,154 @@
+import os
+import argparse
+import datetime
+import jpholiday
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy.dialects.postgresql import insert
+
+from functions import common
+from functions import crawler
+from main import DisclosureClass
+from common.models import Stock, BackfillDay
+from common.database import SessionLocal
+
+class DisclosureBackfiller:
+    """
+    過去の日付の適時開示一覧を取得し、指定銘柄の開示を実際の開示日でDBに保存する
+    銘柄 x 日付ごとに完了を記録するので、中断しても未完了の日だけ取り直す
+    取得・保存に失敗した日は完了を記録しない (次回取り直す)
+    """
+    def __init__(self):
+        self.disclosure = DisclosureClass()
+        # 新規登録銘柄について自動で遡る日数
+        self.backfill_days = int(os.environ.get("BACKFILL_DAYS", "730"))
+        # 同時に取得する日数 (リクエスト間隔は crawl_limiter で全体として制限される)
+        self.day_workers = int(os.environ.get("BACKFILL_DAY_WORKERS", "2"))
+        # 定期実行1回あたりに取得する日数の上限 (残りは次回に回す)
+        self.max_days_per_run = int(os.environ.get("BACKFILL_MAX_DAYS_PER_RUN", "20"))
+
+    def backfill_new_stocks(self):
+        """
+        過去 BACKFILL_DAYS 日のうち、まだ取得できていない日がある銘柄 (新規登録銘柄や、途中で失敗した銘柄) について取得する
+        1回の実行では BACKFILL_MAX_DAYS_PER_RUN 日分まで取得し、残りは次回に回す
+        """
+        db = SessionLocal()
+        try:
+            codes = [code for (code,) in db.query(Stock.stock_code).all()]
+        finally:
+            db.close()
+        if not codes:
+            return
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        self.run(yesterday - datetime.timedelta(days=self.backfill_days), yesterday, codes, self.max_days_per_run)
+
+    def run(self, date_from, date_to, stock_codes, max_days=None):
+        pending = self._get_pending_days(date_from, date_to, stock_codes)
+        if not pending:
+            return
+        print(f"Backfill disclosures {date_from} - {date_to}: {len(pending)} days to crawl")
+        if max_days and len(pending) > max_days:
+            # 新しい日付から順に取得する
+            days = sorted(pending, reverse=True)[:max_days]
+            print(f"Crawling {max_days} days this run, {len(pending) - max_days} days left")
+            pending = {day: pending[day] for day in days}
+
+        self.disclosure.session = crawler.create_session(pool_size=self.disclosure.crawl_workers * self.day_workers)
+        if self.disclosure.archive:
+            self.disclosure.archive.attach(self.disclosure.session)
+        try:
+            with ThreadPoolExecutor(max_workers=self.day_workers) as executor:
+                futures = {executor.submit(self._backfill_day, day, codes): day for day, codes in pending.items()}
+                for future in as_completed(futures):
+                    day = futures[future]
+                    try:
+                        print(f"{day}: {future.result()} disclosures")
+                    except Exception as e:
+                        # 失敗した日は完了扱いにしないので、次回再取得される
+                        print(f"Backfill failed for {day}: {e}")
+        finally:
+            self.disclosure.session.close()
+            self.disclosure.session = None
+
+    def _get_pending_days(self, date_from, date_to, stock_codes):
+        """{日付: まだ取得していない銘柄コードのリスト} を返す (土日祝は開示がないので除く)"""
+        db = SessionLocal()
+        try:
+            done = set(
+                db.query(BackfillDay.crawl_date, BackfillDay.stock_code).filter(
+                    BackfillDay.crawl_date >= date_from,
+                    BackfillDay.crawl_date <= date_to,
+                    BackfillDay.stock_code.in_(stock_codes)
+                ).all()
+            )
+        finally:
+            db.close()
+
+        pending = {}
+        day = date_from
+        while day <= date_to:
+            if day.weekday() < 5 and not jpholiday.is_holiday(day):
+                codes = [code for code in stock_codes if (day, code) not in done]
+                if codes:
+                    pending[day] = codes
+            day += datetime.timedelta(days=1)
+        return pending
+
+    def _backfill_day(self, day, stock_codes):
+        url = common.create_stock_disclosure_url(self.disclosure.stock_disclosure_url, day.timetuple())
+        # ブラウザは1つしかないため、並列に動くバックフィルではSeleniumフォールバックを使わない
+        listing = crawler.get_todays_stock_disclosure_info(
+            self.disclosure.session, url, None, self.disclosure.crawl_workers, self.disclosure.crawl_limiter,
+            max_pages=self.disclosure.crawl_max_pages
+        )
+        filtered = common.filter_disclosure_by_keyword(listing, self.disclosure.search_keyword)
+        items = common.get_my_stock_disclosure_info(filtered, stock_codes)
+        items = crawler.get_disclosure_pdf_info(
+            self.disclosure.session, items, None, self.disclosure.crawl_workers, self.disclosure.crawl_limiter
+        )
+        for item in items:
+            item['announce_date'] = day
+        # 一覧の取得失敗 (IncompleteCrawlError) や保存失敗は例外のまま呼び出し元へ返し、完了を記録しない
+        self.disclosure.update_database(items)
+        # 詳細ページを取得できなかった開示がある銘柄は、次回取り直すため完了にしない
+        failed_codes = {item['stock_code'] for item in items if item.get('fetch_failed')}
+        if failed_codes:
+            print(f"{day}: detail pages failed for {sorted(failed_codes)}, will retry")
+        self._mark_done(day, [code for code in stock_codes if code not in failed_codes], items)
+        return len(items)
+
+    def _mark_done(self, day, stock_codes, items):
+        if not stock_codes:
+            return
+        counts = {code: 0 for code in stock_codes}
+        for item in items:
+            if item['stock_code'] in counts:
+                counts[item['stock_code']] += 1
+        db = SessionLocal()
+        try:
+            stmt = insert(BackfillDay).values([
+                {"stock_code": code, "crawl_date": day, "disclosure_count": count}
+                for code, count in counts.items()
+            ]).on_conflict_do_nothing(constraint="uix_backfill_day_unique")
+            db.execute(stmt)
+            db.commit()
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+if __name__ == "__main__":
+    # 例: python backfill.py --from 2024-01-01 --to 2024-12-31 --codes 7203,6758
+    parser = argparse.ArgumentParser(description="Backfill historical disclosures")
+    parser.add_argument("--from", dest="date_from", type=parse_date, required=True, help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=parse_date, default=datetime.date.today() - datetime.timedelta(days=1), help="終了日 (YYYY-MM-DD, 省略時は前日)")
+    parser.add_argument("--codes", help="銘柄コード (カンマ区切り, 省略時は登録済みの全銘柄)")
+    args = parser.parse_args()
+
+    backfiller = DisclosureBackfiller()
+    codes = args.codes.split(",") if args.codes else backfiller.disclosure.get_my_stock_code_list()
+    backfiller.run(args.date_from, args.date_to, codes)
@@ -0,0 +1,177 @@
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+LISTING_PATH = re.compile(r"^/disclosures/(\d{4})/(\d{2})/(\d{2})$")
+DETAIL_PATH = re.compile(r"^/disclosures/detail/([\w-]+)$")
+
+TITLES = [
+    "2025年3月期 決算短信〔日本基準〕(連結)",
+    "株主優待制度の変更に関するお知らせ",
+    "配当予想の修正に関するお知らせ",
+    "自己株式の取得状況に関するお知らせ",
+    "代表取締役の異動に関するお知らせ",
+]
+
+NO_RESULTS_HTML = """<html><body>
+<div class="container"><div class="alert alert-warning">該当する適時開示はありません</div></div>
+</body></html>"""
+
+class FixtureSite:
+    """
+    適時開示サイトの代わりに一覧・詳細・該当なしページを返す
+    record_dir を指定すると保存済みのHTML (listing_1.html.., detail.html, no_results.html) を返し、
+    指定しなければ pages ページ x rows 行の一覧を生成する
+    """
+    def __init__(self, pages=10, rows=50, stock_codes=None, record_dir=None):
+        self.pages = pages
+        self.rows = rows
+        self.stock_codes = stock_codes or [str(1300 + i) for i in range(200)]
+        self.recorded = {}
+        if record_dir:
+            for name in os.listdir(record_dir):
+                with open(os.path.join(record_dir, name), encoding="utf-8") as f:
+                    self.recorded[name] = f.read()
+            listing_count = len([n for n in self.recorded if n.startswith("listing_")])
+            self.pages = min(pages, listing_count) if pages else listing_count
+
+    def listing(self, page):
+        if page < 1 or page > self.pages:
+            return self.recorded.get("no_results.html", NO_RESULTS_HTML)
+        if f"listing_{page}.html" in self.recorded:
+            return self.recorded[f"listing_{page}.html"]
+        body = []
+        for i in range(self.rows):
+            # 新しい順に並ぶよう、後のページほど早い時刻にする
+            minutes = 21 * 60 - ((page - 1) * self.rows + i) % (14 * 60)
+            n = (page - 1) * self.rows + i
+            code = self.stock_codes[n % len(self.stock_codes)]
+            body.append(
+                f"<tr><td>{minutes // 60:02}:{minutes % 60:02}</td><td>{code}</td><td>テスト{code}</td>"
+                f'<td><a href="/disclosures/detail/{page}-{i}">{TITLES[n % len(TITLES)]}</a></td></tr>'
+            )
+        return (
+            "<html><body><table><thead><tr><th>時刻</th><th>コード</th><th>会社名</th><th>表題</th></tr></thead>"
+            f"<tbody>{''.join(body)}</tbody></table></body></html>"
+        )
+
+    def detail(self, entry_id):
+        if "detail.html" in self.recorded:
+            return self.recorded["detail.html"]
+        return (
+            f'<html><body><ul class="disclosure-info"><li><a download="{entry_id}.pdf" href="/pdf/{entry_id}.pdf">PDF</a></li></ul>'
+            "</body></html>"
+        )
+
+def make_handler(site, latency, stats):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            parsed = urlparse(self.path)
+            if LISTING_PATH.match(parsed.path):
+                page = int(parse_qs(parsed.query).get("page", ["1"])[0])
+                self._send(site.listing(page))
+            elif DETAIL_PATH.match(parsed.path):
+                self._send(site.detail(DETAIL_PATH.match(parsed.path).group(1)))
+            else:
+                self.send_error(404)
+            with stats["lock"]:
+                stats["requests"] += 1
+
+        def _send(self, page_html):
+            body = page_html.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return FixtureHandler
+
+class FixtureServer:
+    """FixtureSite をバックグラウンドスレッドで配信する (port=0 なら空いているポート)"""
+    def __init__(self, site, latency=0.0, port=0):
+        self.stats = {"requests": 0, "lock": threading.Lock()}
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), make_handler(site, latency, self.stats))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def listing_url(self):
+        # SEARCH_DISCLOSURE_URL と同じ形式
+        return self.base_url + "/disclosures/yyyy/mm/dd?page="
+
+    def reset_stats(self):
+        with self.stats["lock"]:
+            self.stats["requests"] = 0
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def record_pages(listing_url, detail_url, out_dir, max_pages=10):
+    """本番サイトから一覧・詳細ページを保存する (listing_url は ...?page= まで)"""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from functions import crawler
+    os.makedirs(out_dir, exist_ok=True)
+    session = crawler.create_session()
+    for page in range(1, max_pages + 2):
+        page_html = crawler.fetch_page(session, listing_url + str(page))
+        if page_html is None:
+            break
+        rows, is_last = crawler.parse_listing_page(page_html, listing_url)
+        name = "no_results.html" if is_last else f"listing_{page}.html"
+        with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
+            f.write(page_html)
+        if is_last:
+            break
+    if detail_url:
+        page_html = crawler.fetch_page(session, detail_url)
+        if page_html is not None:
+            with open(os.path.join(out_dir, "detail.html"), "w", encoding="utf-8") as f:
+                f.write(page_html)
+    session.close()
+
+if __name__ == "__main__":
+    # 例: python fixture_server.py serve --port 8800 --pages 10 --rows 50 --latency 0.05
+    #     python fixture_server.py record --listing-url "https://www.buffett-code.com/disclosures/2025/05/14?page=" --out recorded/
+    parser = argparse.ArgumentParser(description="Disclosure site fixture server")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--port", type=int, default=8800)
+    serve.add_argument("--pages", type=int, default=10, help="一覧のページ数")
+    serve.add_argument("--rows", type=int, default=50, help="1ページの行数")
+    serve.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの応答遅延(秒)")
+    serve.add_argument("--record-dir", help="保存済みHTMLのディレクトリ")
+    record = sub.add_parser("record")
+    record.add_argument("--listing-url", required=True)
+    record.add_argument("--detail-url")
+    record.add_argument("--out", required=True)
+    record.add_argument("--max-pages", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_pages(args.listing_url, args.detail_url, args.out, args.max_pages)
+    else:
+        site = FixtureSite(args.pages, args.rows, record_dir=args.record_dir)
+        with FixtureServer(site, args.latency, args.port) as server:
+            print(f"Serving fixtures at {server.listing_url}")
+            try:
+                server.thread.join()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,131 @@
+import os
+import gzip
+import fcntl
+import sqlite3
+import hashlib
+import datetime
+import threading
+from contextlib import contextmanager
+
+class CrawlArchive:
+    """
+    取得したHTMLページ (一覧・詳細・銘柄別ページ) を保存するアーカイブ (WARC形式に近い構成)
+    - 本文は取得日ごとのセグメントファイル (segments/YYYYMMDD.warc.gz) に、1レコード1つのgzipメンバーとして追記する
+    - 同じ内容(SHA-256)のページは本文を保存せず、索引に既存レコードへの参照 (revisit) だけを追加する
+    - 索引 (index.sqlite) は URL と取得日時で引ける
+    - 同じディレクトリを複数のインスタンス・プロセス (差分クロールとバックフィルなど) が使うので、書き込みはファイルロックで直列化する
+    パーサーの修正やデータ復旧時に、再クロールせず reparse.py でDisclosureを作り直すために使う (reparse.py が使うのは一覧・詳細ページ)
+    """
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.segment_dir = os.path.join(root_dir, "segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(root_dir, "archive.lock")
+        self._db = sqlite3.connect(os.path.join(root_dir, "index.sqlite"), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS payloads (
+                sha256 TEXT PRIMARY KEY,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                record_type TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_records_url ON records (url, fetched_at);
+        """)
+
+    def store(self, url, page_html, fetched_at=None):
+        """ページを保存する。保存済みの内容と同じなら索引だけ追加する"""
+        fetched_at = fetched_at or datetime.datetime.now()
+        body = page_html.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock, self._file_lock():
+            exists = self._db.execute("SELECT 1 FROM payloads WHERE sha256 = ?", (digest,)).fetchone()
+            record_type = "revisit" if exists else "response"
+            if not exists:
+                segment, offset, length = self._append(url, fetched_at, digest, body)
+                self._db.execute(
+                    "INSERT INTO payloads (sha256, segment, offset, length) VALUES (?, ?, ?, ?)",
+                    (digest, segment, offset, length)
+                )
+            self._db.execute(
+                "INSERT INTO records (url, fetched_at, sha256, record_type) VALUES (?, ?, ?, ?)",
+                (url, fetched_at.isoformat(timespec="seconds"), digest, record_type)
+            )
+            self._db.commit()
+
+    @contextmanager
+    def _file_lock(self):
+        """他のインスタンス・プロセスの書き込み (セグメントへの追記と索引の登録) と重ならないようにする"""
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, url, fetched_at, digest, body):
+        """WARC風のヘッダー + 本文を1つのgzipメンバーとしてセグメントに追記する"""
+        header = (
+            "WARC/1.0\r\n"
+            "WARC-Type: response\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            f"WARC-Date: {fetched_at.isoformat(timespec='seconds')}\r\n"
+            f"WARC-Payload-Digest: sha256:{digest}\r\n"
+            "Content-Type: text/html; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("utf-8")
+        member = gzip.compress(header + body + b"\r\n\r\n")
+        segment = fetched_at.strftime("%Y%m%d") + ".warc.gz"
+        with open(os.path.join(self.segment_dir, segment), "ab") as f:
+            # 追記モードでも開いた直後の位置は末尾とは限らないので、明示的に末尾へ移動してから位置を読む
+            offset = f.seek(0, os.SEEK_END)
+            f.write(member)
+        return segment, offset, len(member)
+
+    def response_hook(self, response, *args, **kwargs):
+        """requests.Session のレスポンスフックとして登録し、取得したHTMLを保存する"""
+        if response.status_code == 200 and "html" in response.headers.get("Content-Type", ""):
+            try:
+                self.store(response.url, response.text)
+            except Exception as e:
+                # アーカイブの失敗でクロールを止めない
+                print(f"Archive Error: {e}")
+        return response
+
+    def attach(self, session):
+        session.hooks["response"].append(self.response_hook)
+        return session
+
+    def find(self, url_prefix, fetched_from=None):
+        """URLが url_prefix で始まる記録を (url, fetched_at) の順に返す"""
+        query = "SELECT url, fetched_at, sha256 FROM records WHERE url >= ? AND url < ?"
+        params = [url_prefix, url_prefix + "\U0010ffff"]
+        if fetched_from:
+            query += " AND fetched_at >= ?"
+            params.append(fetched_from.isoformat())
+        with self._lock:
+            return self._db.execute(query + " ORDER BY url, fetched_at", params).fetchall()
+
+    def read(self, sha256):
+        """保存済みの本文(HTML)を返す"""
+        with self._lock:
+            row = self._db.execute("SELECT segment, offset, length FROM payloads WHERE sha256 = ?", (sha256,)).fetchone()
+        if not row:
+            return None
+        segment, offset, length = row
+        with open(os.path.join(self.segment_dir, segment), "rb") as f:
+            f.seek(offset)
+            record = gzip.decompress(f.read(length))
+        _, body = record.split(b"\r\n\r\n", 1)
+        return body[:-4].decode("utf-8")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,4 +1,7 @@
 import time
+import atexit
+import threading
+from contextlib import contextmanager
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
@@ -7,8 +10,12 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import WebDriverException
 from selenium.common.exceptions import TimeoutException
+from functions.crawler import IncompleteCrawlError
 
-def open_browser(selenium_url, headless_mode):
+# 軽量モードで読み込まないリソース (一覧・詳細ページの解析にはDOMだけあればよい)
+BLOCKED_RESOURCE_PATTERNS = ["*.css", "*.woff", "*.woff2", "*.ttf", "*.otf"]
+
+def open_browser(selenium_url, headless_mode, lightweight=False):
     max_retries = 5
     for i in range(max_retries):
         try:
@@ -19,19 +26,132 @@ def open_browser(selenium_url, headless_mode):
             options.add_argument("--disable-dev-shm-usage")
             options.add_argument("--window-size=1920,1080")
             options.add_argument("--disable-logging")
+            if lightweight:
+                # DOMが構築できれば十分なので、サブリソースの読み込みを待たない。画像は設定で無効にする
+                options.page_load_strategy = "eager"
+                options.add_argument("--blink-settings=imagesEnabled=false")
+                options.add_experimental_option("prefs", {
+                    "profile.managed_default_content_settings.images": 2,
+                })
             
             driver = webdriver.Remote(
                 command_executor=selenium_url,
                 options=options
             )
+            if lightweight:
+                block_resources(driver)
             return driver
         except WebDriverException:
             print(f"retrying ({i+1}/{max_retries})")
             time.sleep(2)
 
-def get_todays_stock_disclosure_info(driver, stock_disclosure_url):
+def block_resources(driver):
+    """
+    CSS・フォントはChromeの設定では止められないので、CDP (Network.setBlockedURLs) で読み込みを止める
+    Remote WebDriver でも Chrome なら executeCdpCommand が使える。失敗してもページの取得はできるので続行する
+    """
+    try:
+        driver.execute("executeCdpCommand", {"cmd": "Network.enable", "params": {}})
+        driver.execute("executeCdpCommand", {"cmd": "Network.setBlockedURLs", "params": {"urls": BLOCKED_RESOURCE_PATTERNS}})
+    except WebDriverException as e:
+        print(f"Failed to block resources: {e}")
+
+class PooledDriver:
+    """ページ読み込み回数を数えるためのWebDriverのラッパー (それ以外の操作はそのまま委譲する)"""
+    def __init__(self, driver):
+        self.driver = driver
+        self.page_count = 0
+
+    def get(self, url):
+        self.page_count += 1
+        return self.driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+class DriverPool:
+    """
+    Remote WebDriverのセッションを実行をまたいで使い回すプール
+    - 貸し出し前に生存確認し、Seleniumコンテナ側でタイムアウトしたセッションは作り直す
+    - max_pages ページ読み込んだセッションは返却時に破棄する (ブラウザのメモリ増加対策)
+    - 同時に貸し出すセッションは size 個まで (Seleniumコンテナのセッション数上限)
+    """
+    def __init__(self, selenium_url, headless_mode=False, size=1, max_pages=100):
+        self.selenium_url = selenium_url
+        self.headless_mode = headless_mode
+        self.max_pages = max_pages
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        # プロセス終了時にSeleniumコンテナ側のセッションを残さない
+        atexit.register(self.close)
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    break
+                if self._is_alive(pooled):
+                    return pooled
+                self._quit(pooled)
+            driver = open_browser(self.selenium_url, self.headless_mode, lightweight=True)
+            if driver is None:
+                raise WebDriverException("Could not start browser session")
+            return PooledDriver(driver)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, pooled, broken=False):
+        """使い終わったセッションを返却する。壊れている・上限ページ数に達したものは終了する"""
+        try:
+            if broken or pooled.page_count >= self.max_pages:
+                self._quit(pooled)
+            else:
+                with self._lock:
+                    self._idle.append(pooled)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def driver(self):
+        pooled = self.acquire()
+        broken = False
+        try:
+            yield pooled
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(pooled, broken)
+
+    def close(self):
+        """待機中のセッションをすべて終了する"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._quit(pooled)
+
+    def _is_alive(self, pooled):
+        try:
+            pooled.driver.current_url
+            return True
+        except Exception:
+            # Seleniumコンテナ側で破棄されたセッション・接続できないコンテナ
+            return False
+
+    def _quit(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Error quitting browser: {e}")
+
+def get_todays_stock_disclosure_info(driver, stock_disclosure_url, max_pages=200):
     results = []
-    for i in range(10):
+    for i in range(max_pages):
         stock_disclosure_url_added_page_num =  stock_disclosure_url + str(i + 1)
         driver.get(stock_disclosure_url_added_page_num)
         try:
@@ -57,8 +177,10 @@ def get_todays_stock_disclosure_info(driver, stock_disclosure_url):
                     })
         except Exception as e:
             print(f"Error retrieving stock information: {e}")
-            break
+            raise IncompleteCrawlError(f"Failed to read listing page: {stock_disclosure_url_added_page_num}", results)
         time.sleep(1)
+    else:
+        raise IncompleteCrawlError(f"Reached CRAWL_MAX_PAGES ({max_pages}), remaining pages were not fetched: {stock_disclosure_url}", results)
     return results
 
 def get_disclosure_pdf_info(driver, my_stock_disclosure_info_json):
@@ -67,8 +189,8 @@ def get_disclosure_pdf_info(driver, my_stock_disclosure_info_json):
         new_stock_info = stock_info.copy()
         disclosure_url = stock_info['disclosure_url']
         
-        driver.get(disclosure_url)
         try:
+            driver.get(disclosure_url)
             # "disclosure-info" クラス内の "download" 属性を持つ aタグ が現れるのを最大10秒待つ
             # CSSセレクタの意味: <ul class="disclosure-info"> の中にある <a download="..."> 要素
             pdf_link_elem = WebDriverWait(driver, 10).until(
@@ -83,6 +205,27 @@ def get_disclosure_pdf_info(driver, my_stock_disclosure_info_json):
         except Exception as e:
             print(f"Error accessing {disclosure_url}: {e}")
             new_stock_info['disclosure_pdf_url'] = None
+            # ページを開けなかったものは次回取り直す
+            new_stock_info['fetch_failed'] = True
             
         ret_json.append(new_stock_info)
-    return ret_json
\ No newline at end of file
+    return ret_json
+
+def get_page_source(driver, url, wait_css_selector=None):
+    """
+    HTTPクローラーで解析できないページ(JavaScript描画)用のフォールバック
+    ページを開き、必要なら要素の描画を待ってからHTMLを返す
+    """
+    driver.get(url)
+    try:
+        if wait_css_selector:
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, wait_css_selector))
+            )
+        return driver.page_source
+    except TimeoutException:
+        print(f"Element not found for: {url}")
+        return driver.page_source
+    except Exception as e:
+        print(f"Error accessing {url}: {e}")
+        return None
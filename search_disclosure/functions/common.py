@@ -1,16 +1,21 @@
 import jpholiday
 from datetime import datetime
+from functools import lru_cache
+from common.classifier import DisclosureClassifier
 
 def get_my_stock_disclosure_info(todays_stock_disclosure_info_json, my_stock_info_list):
+    # 1件ごとのリスト走査を避けるため集合で判定する
+    my_stock_codes = set(my_stock_info_list)
     my_stock_disclosure_info_json = []
     for stock_info in todays_stock_disclosure_info_json:
-        if stock_info['stock_code'] in my_stock_info_list:
+        if stock_info['stock_code'] in my_stock_codes:
             my_stock_disclosure_info_json.append({
                     "announce_time": stock_info['announce_time'],
                     "stock_code": stock_info['stock_code'],
                     "company_name": stock_info['company_name'],
                     "disclosure_title": stock_info['disclosure_title'],
-                    "disclosure_url": stock_info['disclosure_url']
+                    "disclosure_url": stock_info['disclosure_url'],
+                    "category": stock_info.get('category')
                 })
     return my_stock_disclosure_info_json
 
@@ -28,14 +33,20 @@ def check_holiday():
     else:
         return False
 
-def filter_disclosure_by_keyword(todays_stock_disclosure_info_json, search_keywords):
-    if not search_keywords:
-        return
-    keywords = search_keywords.split(",")
+@lru_cache(maxsize=8)
+def get_classifier(search_keywords):
+    """キーワードごとに分類器(オートマトン)を1度だけ構築する"""
+    return DisclosureClassifier(search_keywords)
 
-    # フィルタリング処理
-    filtered_list = [
-        item for item in todays_stock_disclosure_info_json
-        if any(keyword in item["disclosure_title"] for keyword in keywords)
-    ]
-    return filtered_list
\ No newline at end of file
+def filter_disclosure_by_keyword(todays_stock_disclosure_info_json, search_keywords):
+    """
+    キーワードを含む開示に絞り込み、各開示にカテゴリを付与する
+    キーワード未設定の場合は全件を返す
+    """
+    classifier = get_classifier(search_keywords or "")
+    filtered_list = []
+    for item in todays_stock_disclosure_info_json:
+        matched, category = classifier.classify(item["disclosure_title"])
+        if matched:
+            filtered_list.append({**item, "category": category})
+    return filtered_list
@@ -0,0 +1,257 @@
+import re
+import time
+import datetime
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+# 「該当なし」ページに表示される警告ボックス (div.alert.alert-warning)
+ALERT_XPATH = (
+    '//body//div[contains(concat(" ", normalize-space(@class), " "), " alert ")'
+    ' and contains(concat(" ", normalize-space(@class), " "), " alert-warning ")]'
+)
+
+class IncompleteCrawlError(Exception):
+    """
+    一覧のページ送りが途中で止まった (取得失敗・解析不能・上限到達) ことを表す
+    results には取得できた分 (新しい順) が入っている。続きは取得していないので、ハイウォーターマークは進めないこと
+    """
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+class RateLimiter:
+    """
+    複数スレッドから呼ばれても、リクエスト開始の間隔を min_interval 秒以上空ける (サイトへの負荷配慮)
+    """
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+def create_session(pool_size=10):
+    """コネクションを使い回すHTTPセッションを作成する"""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+def fetch_page(session, url, timeout=10, limiter=None):
+    """ページのHTMLを取得する。取得できなければNoneを返す"""
+    if limiter:
+        limiter.wait()
+    try:
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.text
+    except requests.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+
+def _text(element):
+    # 改行・連続空白をまとめて、ブラウザ表示上のテキストに揃える
+    return " ".join(element.text_content().split())
+
+def parse_listing_page(page_html, page_url):
+    """
+    適時開示一覧ページを解析する
+    戻り値: (開示情報のリスト, 最終ページを超えたかどうか)
+    テーブルも警告ボックスもない場合(JavaScript描画が必要なページ)は (None, False) を返す
+    """
+    doc = lxml_html.fromstring(page_html)
+    if doc.xpath(ALERT_XPATH):
+        return [], True
+    rows = doc.xpath("//tbody/tr")
+    if not rows and not doc.xpath("//table"):
+        return None, False
+
+    results = []
+    for row in rows:
+        columns = row.xpath("./td")
+        if len(columns) < 4:
+            continue
+        links = columns[3].xpath(".//a[@href]")
+        if not links:
+            continue
+        results.append({
+            "announce_time": _text(columns[0]),
+            "stock_code": _text(columns[1]),
+            "company_name": _text(columns[2]),
+            "disclosure_title": _text(columns[3]),
+            "disclosure_url": urljoin(page_url, links[0].get("href").strip())
+        })
+    return results, False
+
+def parse_detail_page(page_html, page_url):
+    """適時開示詳細ページから a[download] のPDF URLを取得する。なければNone"""
+    doc = lxml_html.fromstring(page_html)
+    hrefs = doc.xpath("//a[@download]/@href")
+    if not hrefs:
+        return None
+    return urljoin(page_url, hrefs[0].strip())
+
+def parse_announce_time(value):
+    """開示時刻 ("9:05" / "09:05" など) を datetime.time にする。読めなければ None"""
+    match = TIME_PATTERN.search(value or "")
+    if not match:
+        return None
+    hour, minute = map(int, match.group(1).split(":"))
+    try:
+        return datetime.time(hour, minute)
+    except ValueError:
+        return None
+
+def reached_high_water_mark(row, high_water_mark):
+    """前回取得済みの最新開示 (announce_time, disclosure_url) か、それより古い開示か"""
+    if not high_water_mark:
+        return False
+    last_time, last_url = high_water_mark
+    if row["disclosure_url"] == last_url:
+        return True
+    # 文字列のままだと "9:05" と "10:00" の比較を誤るので時刻にしてから比べる
+    row_time, mark_time = parse_announce_time(row["announce_time"]), parse_announce_time(last_time)
+    return row_time is not None and mark_time is not None and row_time < mark_time
+
+def rows_since_high_water_mark(rows, high_water_mark):
+    """新しい順の一覧から、前回取得済みの開示より新しい行だけを返す"""
+    for i, row in enumerate(rows):
+        if reached_high_water_mark(row, high_water_mark):
+            return rows[:i]
+    return rows
+
+def get_todays_stock_disclosure_info(session, stock_disclosure_url, render_fallback=None, workers=4, limiter=None, high_water_mark=None, max_pages=200):
+    """
+    browser.get_todays_stock_disclosure_info のHTTP版
+    workers ページずつ並列に取得し、「該当なし」ページが出たらそれ以降は取得しない
+    render_fallback: JavaScript描画が必要なページ用に url -> HTML を返す関数 (Selenium)
+    high_water_mark: 前回取得済みの最新開示 (announce_time, disclosure_url)。
+                     一覧は新しい順なので、これに到達したらそれ以降のページは取得しない
+    max_pages: 「該当なし」ページが返らない場合に備えた安全上限
+    最後まで取得できなかった場合は IncompleteCrawlError (取得できた分を持つ) を投げる
+    """
+    results = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first_page = 1
+        while first_page <= max_pages:
+            # 差分取得時は1ページ目だけで済むことが多いので、最初は1ページだけ取得する
+            wave = 1 if high_water_mark and first_page == 1 else workers
+            page_numbers = range(first_page, min(first_page + wave, max_pages + 1))
+            first_page += wave
+            page_urls = [stock_disclosure_url + str(n) for n in page_numbers]
+            pages = executor.map(lambda url: fetch_page(session, url, limiter=limiter), page_urls)
+            # ページ順に解析し、最終ページを超えたらそこで打ち切る
+            for page_url, page_html in zip(page_urls, pages):
+                if page_html is None:
+                    raise IncompleteCrawlError(f"Failed to fetch listing page: {page_url}", results)
+                rows, is_last = parse_listing_page(page_html, page_url)
+                if rows is None and render_fallback:
+                    print(f"Fallback to browser: {page_url}")
+                    rendered = render_fallback(page_url, "tbody tr, div.alert")
+                    if rendered:
+                        rows, is_last = parse_listing_page(rendered, page_url)
+                if is_last:
+                    return results
+                if rows is None:
+                    raise IncompleteCrawlError(f"Failed to parse listing page: {page_url}", results)
+                for row in rows:
+                    if reached_high_water_mark(row, high_water_mark):
+                        return results
+                    results.append(row)
+    raise IncompleteCrawlError(f"Reached CRAWL_MAX_PAGES ({max_pages}), remaining pages were not fetched: {stock_disclosure_url}", results)
+
+DATE_PATTERN = re.compile(r"(\d{4})[/年-](\d{1,2})[/月-](\d{1,2})")
+TIME_PATTERN = re.compile(r"(\d{1,2}:\d{2})")
+
+def parse_stock_disclosure_page(page_html, page_url, stock_code, target_date):
+    """
+    銘柄別の適時開示ページから target_date の開示を取得する
+    行の中の日付・時刻と最初のリンク(表題)を使うので、列の並びには依存しない
+    """
+    doc = lxml_html.fromstring(page_html)
+    results = []
+    for row in doc.xpath("//tbody/tr"):
+        row_text = _text(row)
+        date_match = DATE_PATTERN.search(row_text)
+        time_match = TIME_PATTERN.search(row_text)
+        links = row.xpath(".//a[@href]")
+        if not date_match or not time_match or not links:
+            continue
+        if datetime.date(*map(int, date_match.groups())) != target_date:
+            continue
+        hour, minute = time_match.group(1).split(":")
+        results.append({
+            "announce_time": f"{int(hour):02}:{minute}", # 一覧と同じ HH:MM に揃える
+            "stock_code": stock_code,
+            "company_name": "",
+            "disclosure_title": _text(links[0]),
+            "disclosure_url": urljoin(page_url, links[0].get("href").strip())
+        })
+    return results
+
+def get_stocks_disclosure_info(session, stock_url_template, stock_codes, target_date, workers=4, limiter=None):
+    """
+    一覧全体を走査する代わりに、銘柄別の適時開示ページ (stock_url_template の cccc を銘柄コードに置換) を並列に取得する
+    1銘柄の1日分の開示は1ページ目に収まる前提。戻り値は一覧と同じ形式 (新しい順)
+    """
+    def fetch_stock(stock_code):
+        url = stock_url_template.replace("cccc", stock_code)
+        page_html = fetch_page(session, url, limiter=limiter)
+        return parse_stock_disclosure_page(page_html, url, stock_code, target_date) if page_html is not None else []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = list(executor.map(fetch_stock, stock_codes))
+    results = [row for rows in pages for row in rows]
+    results.sort(key=lambda row: row["announce_time"], reverse=True)
+    return results
+
+def get_disclosure_pdf_info(session, my_stock_disclosure_info_json, render_fallback=None, workers=4, limiter=None):
+    """
+    browser.get_disclosure_pdf_info のHTTP版
+    詳細ページを並列に取得するので、遅いページがあっても他のページの処理は止まらない
+    詳細ページ自体を取得できなかったものは fetch_failed=True にする (次回取り直す対象。PDFリンクがないだけのページとは区別する)
+    """
+    def fetch_pdf_url(stock_info):
+        page_html = fetch_page(session, stock_info['disclosure_url'], limiter=limiter)
+        if page_html is None:
+            return None, False
+        return parse_detail_page(page_html, stock_info['disclosure_url']), True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(executor.map(fetch_pdf_url, my_stock_disclosure_info_json))
+
+    ret_json = []
+    for stock_info, (pdf_url, page_fetched) in zip(my_stock_disclosure_info_json, fetched):
+        new_stock_info = stock_info.copy()
+        disclosure_url = stock_info['disclosure_url']
+        # リンクがJavaScriptで描画される場合はブラウザで取得し直す (ブラウザは1つなので順番に)
+        if pdf_url is None and render_fallback:
+            print(f"Fallback to browser: {disclosure_url}")
+            page_html = render_fallback(disclosure_url, "a[download]")
+            pdf_url = parse_detail_page(page_html, disclosure_url) if page_html else None
+            page_fetched = page_fetched or page_html is not None
+        if not page_fetched:
+            print(f"Failed to fetch detail page: {disclosure_url}")
+        elif pdf_url is None:
+            print(f"PDF link not found for: {disclosure_url}")
+        new_stock_info['disclosure_pdf_url'] = pdf_url
+        new_stock_info['fetch_failed'] = not page_fetched
+        ret_json.append(new_stock_info)
+    return ret_json
@@ -1,11 +1,19 @@
 import os
+import math
 import time
 import datetime
+import statistics
 
 from functions import browser
 from functions import common
-from common.models import Stock, Disclosure
+from functions import crawler
+from functions.archive import CrawlArchive
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects.postgresql import insert
+from common.models import Stock, Disclosure, CrawlState
 from common.database import engine, SessionLocal, Base
+from common.priority import refresh_pending_priorities
 
 class DisclosureClass:
     def __init__(self):
@@ -13,6 +21,43 @@ class DisclosureClass:
         self.stock_disclosure_url = os.environ.get("SEARCH_DISCLOSURE_URL")
         self.database_url = os.environ.get("DATABASE_URL")
         self.search_keyword = os.environ.get("SEARCH_KEYWORD")
+        # http: requestsで取得しJavaScript描画が必要なページだけSelenium / selenium: 従来通り全ページSelenium
+        self.crawler_mode = os.environ.get("CRAWLER_MODE", "http")
+        self.driver = None
+        self.session = None
+        # ブラウザセッションは実行をまたいで使い回し、DRIVER_MAX_PAGES ページごとに作り直す
+        self.driver_pool = browser.DriverPool(
+            self.selenium_url, False, size=1, max_pages=int(os.environ.get("DRIVER_MAX_PAGES", "100"))
+        )
+        # 並列取得数と、リクエスト開始の最小間隔(秒)
+        self.crawl_workers = int(os.environ.get("CRAWL_MAX_WORKERS", "4"))
+        self.crawl_limiter = crawler.RateLimiter(float(os.environ.get("CRAWL_MIN_INTERVAL", "0.3")))
+        # 差分クロールを行う時間帯 (HH:MM)
+        self.crawl_start = os.environ.get("CRAWL_START", "07:00")
+        self.crawl_end = os.environ.get("CRAWL_END", "21:00")
+        # 銘柄別の適時開示ページ (cccc を銘柄コードに置換)。未設定なら常に一覧全体を走査する
+        self.stock_page_url = os.environ.get("STOCK_DISCLOSURE_URL")
+        # 一覧のページ送りの安全上限と、1ページあたりの件数
+        self.crawl_max_pages = int(os.environ.get("CRAWL_MAX_PAGES", "200"))
+        self.listing_rows_per_page = int(os.environ.get("LISTING_ROWS_PER_PAGE", "50"))
+        # 決算シーズンに一覧の件数が増える倍率 (前年同時期の実績がない場合に使う)
+        self.earnings_season_factor = float(os.environ.get("EARNINGS_SEASON_FACTOR", "3"))
+        # 取得したページを保存するアーカイブ (未設定なら保存しない)
+        archive_dir = os.environ.get("CRAWL_ARCHIVE_DIR")
+        self.archive = CrawlArchive(archive_dir) if archive_dir else None
+
+    def incremental_process(self):
+        """
+        スケジューラから数分おきに呼ばれる。平日の取得時間帯のみ差分クロールを行う
+        """
+        now = datetime.datetime.now()
+        if now.weekday() >= 5 or not (self.crawl_start <= now.strftime("%H:%M") <= self.crawl_end):
+            return None
+        try:
+            self.main_process()
+        except Exception as e:
+            # ハイウォーターマークは進んでいないので、次回の実行で取り直す
+            print(f"Crawl failed: {e}")
 
     def main_process(self):
         # 祝日だった場合、処理を行わない
@@ -20,45 +65,201 @@ class DisclosureClass:
         if common.check_holiday():
             print("Today is holiday, quit process")
             return None
-        # ブラウザ起動
-        driver = browser.open_browser(self.selenium_url, False)
-
-        # 今日の適時開示からキーワードを含む情報を取得
-        print("Get today's stock disclosure information")
-        date = time.localtime()
-        todays_stock_disclosure_info_json = self.get_stock_disclosure(driver, date)
-        
-        # DBから自分の保有株式コードを取得
-        print("Get my stock code list from DB")
-        my_stock_code_list = self.get_my_stock_code_list()
-
-        # 保有株式コードに該当する適時開示情報を取得
-        print("Pick up my stock in the stock disclosure information")
-        my_stock_disclosure_info_json = self.pickup_my_stock_disclosure(driver, todays_stock_disclosure_info_json, my_stock_code_list)
-
-        # テーブル更新
-        print("Update database")
-        self.update_database(my_stock_disclosure_info_json)
-        print("my_stock_disclosure_info_json")
-        print(my_stock_disclosure_info_json)
+        try:
+            if self.crawler_mode == "selenium":
+                # プールからブラウザを借りる
+                self.driver = self.driver_pool.acquire()
+            else:
+                # HTTPセッション作成 (ブラウザはフォールバックが必要になった時だけ起動)
+                self.session = crawler.create_session(pool_size=self.crawl_workers)
+                if self.archive:
+                    self.archive.attach(self.session)
+
+            # DBから自分の保有株式コードを取得
+            print("Get my stock code list from DB")
+            my_stock_code_list = self.get_my_stock_code_list()
+
+            date = time.localtime()
+            crawl_date = datetime.date(date.tm_year, date.tm_mon, date.tm_mday)
+            high_water_mark = self.get_high_water_mark(crawl_date)
+            strategy = self.choose_crawl_strategy(crawl_date, high_water_mark, my_stock_code_list)
+            # 一覧を最後 (前回の取得位置) まで取得できたか
+            listing_complete = True
+            if strategy == "per_stock":
+                # 保有銘柄ごとのページから今日の開示を取得
+                print(f"Get today's disclosures of {len(my_stock_code_list)} stocks from per-stock pages")
+                new_disclosure_info_json = crawler.get_stocks_disclosure_info(
+                    self.session, self.stock_page_url, my_stock_code_list, crawl_date, self.crawl_workers, self.crawl_limiter
+                )
+            else:
+                # 今日の適時開示のうち、前回取得済みの開示より新しいものを取得
+                print("Get today's stock disclosure information")
+                try:
+                    new_disclosure_info_json = self.get_stock_disclosure(date, high_water_mark)
+                except crawler.IncompleteCrawlError as e:
+                    # 取得できた分は保存するが、続きが未取得なのでハイウォーターマークは進めない
+                    print(f"Listing crawl incomplete, keeping the high-water mark: {e}")
+                    new_disclosure_info_json = e.results
+                    listing_complete = False
+                # Selenium版は一覧を最後まで読むので、前回取得済みの位置より古い行を除く (件数を二重に数えないため)
+                new_disclosure_info_json = crawler.rows_since_high_water_mark(new_disclosure_info_json, high_water_mark)
+                print(f"{len(new_disclosure_info_json)} new disclosures since {high_water_mark[0] if high_water_mark else 'start of day'}")
+
+            # キーワードを含む情報に絞り込む
+            todays_stock_disclosure_info_json = common.filter_disclosure_by_keyword(new_disclosure_info_json, self.search_keyword)
+
+            # 保有株式コードに該当する適時開示情報を取得
+            print("Pick up my stock in the stock disclosure information")
+            my_stock_disclosure_info_json = self.pickup_my_stock_disclosure(todays_stock_disclosure_info_json, my_stock_code_list)
+
+            # テーブル更新
+            print("Update database")
+            self.update_database(my_stock_disclosure_info_json)
+            print("my_stock_disclosure_info_json")
+            print(my_stock_disclosure_info_json)
+
+            # DB保存に成功した後でハイウォーターマークを進める (update_database は失敗時に例外を投げるのでここに来ない)
+            # 一覧を最後まで取得できなかった場合は進めず、詳細ページを取得できなかった開示があればそれより古い位置までにとどめる
+            # 銘柄別ページの結果は一覧全体の件数ではないので、一覧走査時のみ記録する
+            if strategy == "listing" and listing_complete:
+                failed_urls = {item['disclosure_url'] for item in my_stock_disclosure_info_json if item.get('fetch_failed')}
+                self.save_high_water_mark(crawl_date, new_disclosure_info_json, failed_urls)
+        finally:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+            if self.driver is not None:
+                # 終了はせずプールに返却する (壊れたセッションは次回の貸し出し時に作り直す)
+                self.driver_pool.release(self.driver)
+                self.driver = None
+
+    def _render_with_browser(self, url, wait_css_selector):
+        """JavaScript描画が必要なページだけSeleniumで取得する (プールのブラウザを使う)"""
+        with self.driver_pool.driver() as driver:
+            page_html = browser.get_page_source(driver, url, wait_css_selector)
+        if page_html and self.archive:
+            self.archive.store(url, page_html)
+        return page_html
 
     """
     当日の適時開示情報を取得する
     """
-    def get_stock_disclosure(self, driver, date):
+    def get_stock_disclosure(self, date, high_water_mark=None):
         todays_stock_disclosure_url = common.create_stock_disclosure_url(self.stock_disclosure_url, date)
         # get stock disclosure information
-        todays_stock_disclosure_info = browser.get_todays_stock_disclosure_info(driver, todays_stock_disclosure_url)
-        # select containing search keyword
-        filtered_json = common.filter_disclosure_by_keyword(todays_stock_disclosure_info, self.search_keyword)
-        return filtered_json
+        if self.crawler_mode == "selenium":
+            return browser.get_todays_stock_disclosure_info(self.driver, todays_stock_disclosure_url, self.crawl_max_pages)
+        return crawler.get_todays_stock_disclosure_info(
+            self.session, todays_stock_disclosure_url, self._render_with_browser, self.crawl_workers, self.crawl_limiter,
+            high_water_mark, self.crawl_max_pages
+        )
+
+    """
+    一覧全体を走査するか、保有銘柄ごとのページを取得するかを取得ページ数の見積もりで決める
+    """
+    def choose_crawl_strategy(self, crawl_date, high_water_mark, stock_codes):
+        if self.crawler_mode == "selenium" or not self.stock_page_url:
+            return "listing"
+        listing_pages = self.estimate_listing_pages(crawl_date, high_water_mark)
+        # 銘柄別ページは1銘柄1ページ
+        strategy = "per_stock" if len(stock_codes) < listing_pages else "listing"
+        print(f"Crawl strategy: {strategy} (listing ~{listing_pages} pages, per-stock {len(stock_codes)} pages)")
+        return strategy
+
+    """
+    当日の一覧で今回取得が必要なページ数を、過去の開示件数 (CrawlState.entry_count) から見積もる
+    """
+    def estimate_listing_pages(self, crawl_date, high_water_mark):
+        db = SessionLocal()
+        try:
+            recent_counts = [
+                count for (count,) in db.query(CrawlState.entry_count).filter(
+                    CrawlState.crawl_date < crawl_date,
+                    CrawlState.entry_count > 0
+                ).order_by(CrawlState.crawl_date.desc()).limit(20).all()
+            ]
+            # 前年同時期 (同じ曜日の前後1週間) の最大件数
+            last_year_count = db.query(func.max(CrawlState.entry_count)).filter(
+                CrawlState.crawl_date >= crawl_date - datetime.timedelta(days=371),
+                CrawlState.crawl_date <= crawl_date - datetime.timedelta(days=357)
+            ).scalar()
+            today = db.query(CrawlState).filter(CrawlState.crawl_date == crawl_date).first()
+            fetched_today = today.entry_count if today else 0
+        finally:
+            db.close()
+
+        expected = statistics.median(recent_counts) if recent_counts else self.listing_rows_per_page * 5
+        if last_year_count:
+            expected = max(expected, last_year_count)
+        elif self.is_earnings_season(crawl_date):
+            expected *= self.earnings_season_factor
+        # 差分取得ではハイウォーターマークより新しい分だけ (最低1ページ)
+        if high_water_mark:
+            expected = max(expected - fetched_today, 0)
+        return max(1, math.ceil(expected / self.listing_rows_per_page))
+
+    @staticmethod
+    def is_earnings_season(day):
+        """決算発表が集中する時期 (1/20〜2/15, 4/20〜5/15, 7/20〜8/15, 10/20〜11/15)"""
+        return (day.month in (1, 4, 7, 10) and day.day >= 20) or (day.month in (2, 5, 8, 11) and day.day <= 15)
+
+    """
+    前回までに取得済みの最新開示 (開示時刻, URL) を取得する
+    """
+    def get_high_water_mark(self, crawl_date):
+        db = SessionLocal()
+        try:
+            state = db.query(CrawlState).filter(CrawlState.crawl_date == crawl_date).first()
+            if state and state.last_entry_url:
+                return (state.last_announce_time, state.last_entry_url)
+            return None
+        finally:
+            db.close()
+
+    """
+    今回取得した中で最新の開示をハイウォーターマークとして保存する
+    failed_urls (詳細ページを取得できなかった開示) があれば、次回それを取り直せるよう、その中で最も古いものより古い位置までしか進めない
+    """
+    def save_high_water_mark(self, crawl_date, new_disclosure_info_json, failed_urls=()):
+        # 一覧は新しい順なので、最後の失敗より後ろ (古い側) だけが確定済み
+        settled_from = 0
+        for i, row in enumerate(new_disclosure_info_json):
+            if row['disclosure_url'] in failed_urls:
+                settled_from = i + 1
+        settled = new_disclosure_info_json[settled_from:]
+        if settled_from:
+            print(f"{len(failed_urls)} disclosures failed, high-water mark advanced only past {len(settled)} settled entries")
+        if not settled:
+            return
+        # 確定済みのうち先頭が最新 (件数は次回取り直さない分だけ数える)
+        latest = settled[0]
+        db = SessionLocal()
+        try:
+            state = db.query(CrawlState).filter(CrawlState.crawl_date == crawl_date).first()
+            if not state:
+                state = CrawlState(crawl_date=crawl_date, entry_count=0)
+                db.add(state)
+            state.last_announce_time = latest['announce_time']
+            state.last_entry_url = latest['disclosure_url']
+            state.entry_count = (state.entry_count or 0) + len(settled)
+            db.commit()
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+        finally:
+            db.close()
 
     """
     適時開示情報の中から自身の保有株式コードに該当するものを取得する
     """
-    def pickup_my_stock_disclosure(self, driver, todays_stock_disclosure_info_json, my_stock_code_list):
+    def pickup_my_stock_disclosure(self, todays_stock_disclosure_info_json, my_stock_code_list):
         temp_my_stock_disclosure_info_json = common.get_my_stock_disclosure_info(todays_stock_disclosure_info_json, my_stock_code_list)
-        my_stock_disclosure = browser.get_disclosure_pdf_info(driver, temp_my_stock_disclosure_info_json)
+        if self.crawler_mode == "selenium":
+            my_stock_disclosure = browser.get_disclosure_pdf_info(self.driver, temp_my_stock_disclosure_info_json)
+        else:
+            my_stock_disclosure = crawler.get_disclosure_pdf_info(
+                self.session, temp_my_stock_disclosure_info_json, self._render_with_browser, self.crawl_workers, self.crawl_limiter
+            )
         return my_stock_disclosure
 
     """
@@ -78,48 +279,102 @@ class DisclosureClass:
         return stock_list
 
     def update_database(self, my_stock_disclosure_info_json):
-        """取得した情報をDBに保存する"""
+        """
+        取得した情報をDBに保存し、追加した件数を返す
+        既存キーは1回のクエリでまとめて取得し、新規分だけを1文のINSERTで追加する。
+        並行実行などで重複した行は ON CONFLICT DO NOTHING で読み飛ばすので、1件の重複で全体がロールバックされることはない
+        DBエラー (接続断など) は呼び出し側が取得済みの位置を進めないよう、そのまま例外として投げる
+        """
+        rows = self._build_rows(my_stock_disclosure_info_json)
+        if not rows:
+            print("0 inserted, 0 skipped.")
+            return 0
+
         db = SessionLocal()
         try:
-            for item in my_stock_disclosure_info_json:
-                # PDF URLが取得できていないものはスキップする場合
-                if not item.get('disclosure_pdf_url'):
+            # 対象日の既存キーを1回で取得
+            first_day = min(r["announce_date"] for r in rows).replace(hour=0, minute=0)
+            last_day = max(r["announce_date"] for r in rows).replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            existing_keys = set(
+                db.query(Disclosure.stock_code, Disclosure.announce_date, Disclosure.title).filter(
+                    Disclosure.announce_date >= first_day,
+                    Disclosure.announce_date < last_day
+                ).all()
+            )
+            new_rows = []
+            for row in rows:
+                key = (row["stock_code"], row["announce_date"], row["title"])
+                if key in existing_keys:
                     continue
+                existing_keys.add(key) # 同じ取得結果内の重複も除く
+                new_rows.append(row)
 
-                # announce_timeをdatetimeに変換
-                now = datetime.datetime.now()
-                announce_time_str = item['announce_time']
-                hour, minute = map(int, announce_time_str.split(':'))
-                announce_dt = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-
-                # Disclosureモデルのインスタンス作成
-                new_disclosure = Disclosure(
-                    stock_code=item['stock_code'],
-                    announce_date=announce_dt,
-                    title=item['disclosure_title'],
-                    pdf_url=item['disclosure_pdf_url'],
-                    web_url=item['disclosure_url'],
-                    status="PENDING" # Gemini処理待ち状態にする
-                )
-
-                # 重複チェック (UniqueConstraintがあるが、Python側でも確認すると丁寧)
-                exists = db.query(Disclosure).filter_by(
-                    stock_code=new_disclosure.stock_code,
-                    title=new_disclosure.title,
-                    announce_date=new_disclosure.announce_date
-                ).first()
-
-                if not exists:
-                    print(f"Adding to DB: {new_disclosure.title}")
-                    db.add(new_disclosure)
-                else:
-                    print(f"Skipping duplicate: {new_disclosure.title}")
-            
-            db.commit() # まとめて保存
-            print(f"{len(my_stock_disclosure_info_json)} updated.")
+            inserted = 0
+            if new_rows:
+                try:
+                    stmt = insert(Disclosure).values(new_rows).on_conflict_do_nothing(
+                        constraint="uix_disclosure_unique"
+                    ).returning(Disclosure.id)
+                    inserted = len(db.execute(stmt).fetchall())
+                    db.commit()
+                except Exception as e:
+                    # 1件の不正データで全体を失わないよう、1件ずつ入れ直す
+                    print(f"Bulk insert failed, retrying row by row: {e}")
+                    db.rollback()
+                    inserted = self._insert_rows_one_by_one(db, new_rows)
+            for row in new_rows:
+                print(f"New disclosure: {row['title']}")
+            print(f"{inserted} inserted, {len(rows) - inserted} skipped.")
+            # 新しい開示を分析キューの正しい位置に並べる
+            if inserted:
+                refresh_pending_priorities()
+            return inserted
 
         except Exception as e:
             print(f"DB Error: {e}")
             db.rollback() # エラー時はロールバック
+            raise
         finally:
-            db.close()
\ No newline at end of file
+            db.close()
+
+    def _build_rows(self, my_stock_disclosure_info_json):
+        """取得結果を disclosures の行 (dict) に変換する (PDF URL や開示時刻が取れていないものは除く)"""
+        rows = []
+        now = datetime.datetime.now()
+        for item in my_stock_disclosure_info_json:
+            # PDF URLが取得できていないものはスキップする場合
+            if not item.get('disclosure_pdf_url'):
+                continue
+            # announce_timeをdatetimeに変換
+            try:
+                hour, minute = map(int, item['announce_time'].split(':'))
+            except ValueError:
+                print(f"Invalid announce_time: {item['announce_time']} ({item['disclosure_title']})")
+                continue
+            # 過去分の取得(バックフィル)では一覧の日付、通常は当日
+            announce_day = item.get('announce_date') or now.date()
+            rows.append({
+                "stock_code": item['stock_code'],
+                "announce_date": datetime.datetime.combine(announce_day, datetime.time(hour, minute)),
+                "title": item['disclosure_title'],
+                "pdf_url": item['disclosure_pdf_url'],
+                "web_url": item['disclosure_url'],
+                "category": item.get('category') or common.get_classifier(self.search_keyword or "").categorize(item['disclosure_title']),
+                "status": "PENDING" # Gemini処理待ち状態にする
+            })
+        return rows
+
+    def _insert_rows_one_by_one(self, db, rows):
+        inserted = 0
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    stmt = insert(Disclosure).values(row).on_conflict_do_nothing(constraint="uix_disclosure_unique")
+                    inserted += db.execute(stmt).rowcount
+            except OperationalError:
+                # 接続断などは行の問題ではないので全体を失敗にする
+                raise
+            except Exception as e:
+                print(f"Skipping invalid row: {row['title']} ({e})")
+        db.commit()
+        return inserted
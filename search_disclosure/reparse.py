@@ -0,0 +1,153 @@
+import os
+import argparse
+import datetime
+
+from functions import common
+from functions import crawler
+from functions.archive import CrawlArchive
+from main import DisclosureClass
+from sqlalchemy.dialects.postgresql import insert
+from common.models import Disclosure
+from common.database import SessionLocal
+from common.priority import refresh_pending_priorities
+
+class DisclosureReparser:
+    """
+    アーカイブ済みの一覧・詳細ページを解析し直してDisclosureを作り直す (再クロールしない)
+    パーサー修正後の再取り込みや、過去データの復旧に使う
+    """
+    def __init__(self):
+        archive_dir = os.environ.get("CRAWL_ARCHIVE_DIR")
+        if not archive_dir:
+            raise ValueError("CRAWL_ARCHIVE_DIR is not set")
+        self.archive = CrawlArchive(archive_dir)
+        self.disclosure = DisclosureClass()
+        self._html_cache = {}
+
+    def run(self, date_from, date_to, stock_codes, replace=False):
+        day = date_from
+        total = 0
+        while day <= date_to:
+            items = self.rebuild_day(day, stock_codes)
+            if items:
+                # 失敗した場合は例外のまま止める (その日のDBは変更されていない)
+                if replace:
+                    self._replace_day(day, items)
+                else:
+                    self.disclosure.update_database(items)
+                total += len(items)
+            day += datetime.timedelta(days=1)
+        print(f"Reparse completed: {total} disclosures")
+
+    def rebuild_day(self, day, stock_codes):
+        """
+        その日の一覧ページ(取得したすべての版)と銘柄別ページから開示を集め、詳細ページからPDF URLを取り出す
+        (保有銘柄が少ない日は銘柄別ページだけで取得しているので、一覧ページがなくても作り直せる)
+        """
+        listing_prefix = common.create_stock_disclosure_url(self.disclosure.stock_disclosure_url, day.timetuple())
+        rows = {}
+        for url, _, sha256 in self.archive.find(listing_prefix):
+            parsed, _ = crawler.parse_listing_page(self._read(sha256), url)
+            # 差分クロールで同じページを何度も取得しているので、開示URLで重複を除く
+            for row in parsed or []:
+                rows.setdefault(row['disclosure_url'], row)
+        for row in self._rebuild_from_stock_pages(day, stock_codes):
+            rows.setdefault(row['disclosure_url'], row)
+        if not rows:
+            if day.weekday() < 5:
+                print(f"{day}: no archived listing or per-stock pages, cannot rebuild (existing disclosures are kept)")
+            return []
+
+        filtered = common.filter_disclosure_by_keyword(list(rows.values()), self.disclosure.search_keyword)
+        items = common.get_my_stock_disclosure_info(filtered, stock_codes)
+        for item in items:
+            item['announce_date'] = day
+            item['disclosure_pdf_url'] = None
+            # 最後に取得した詳細ページを使う
+            records = [r for r in self.archive.find(item['disclosure_url']) if r[0] == item['disclosure_url']]
+            if records:
+                item['disclosure_pdf_url'] = crawler.parse_detail_page(self._read(records[-1][2]), item['disclosure_url'])
+        print(f"{day}: {len(rows)} archived disclosures, {len(items)} for target stocks")
+        return items
+
+    def _rebuild_from_stock_pages(self, day, stock_codes):
+        """その日以降に取得した銘柄別ページ (すべての版) から、その日の開示を集める"""
+        if not self.disclosure.stock_page_url:
+            return []
+        rows = []
+        fetched_from = datetime.datetime.combine(day, datetime.time())
+        for stock_code in stock_codes:
+            url = self.disclosure.stock_page_url.replace("cccc", stock_code)
+            for record_url, _, sha256 in self.archive.find(url, fetched_from):
+                if record_url == url:
+                    rows += crawler.parse_stock_disclosure_page(self._read(sha256), url, stock_code, day)
+        return rows
+
+    def _read(self, sha256):
+        if sha256 not in self._html_cache:
+            self._html_cache[sha256] = self.archive.read(sha256)
+        return self._html_cache[sha256]
+
+    def _replace_day(self, day, items):
+        """
+        作り直した開示で既存レコードを置き換える (1トランザクション。失敗したら何も変更せずに例外を投げる)
+        - 解析し直した行を追加し、同じキーの既存行は PDF URL が変わった場合だけ更新して再分析させる
+        - 削除するのは、作り直した開示と同じ開示ページ (web_url) を指すがキー (時刻・表題) が変わった古い行だけ
+          (アーカイブに詳細ページがなくPDF URLを取れなかった開示などの既存行は残す)
+        """
+        # 同じキーが1文に2回入ると ON CONFLICT DO UPDATE が失敗するので除く
+        rows = list({(row["stock_code"], row["announce_date"], row["title"]): row for row in self.disclosure._build_rows(items)}.values())
+        if not rows:
+            print(f"{day}: no rebuilt disclosures with a PDF URL, nothing replaced")
+            return
+        db = SessionLocal()
+        try:
+            stmt = insert(Disclosure).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                constraint="uix_disclosure_unique",
+                # 分析し直すので、再試行の記録 (バックオフ・回数) も消す
+                set_={
+                    "pdf_url": stmt.excluded.pdf_url, "web_url": stmt.excluded.web_url, "status": "PENDING",
+                    "attempt_count": 0, "next_attempt_at": None, "last_error": None, "claimed_by": None
+                },
+                where=Disclosure.pdf_url.is_distinct_from(stmt.excluded.pdf_url)
+            ).returning(Disclosure.id)
+            kept_ids = [row_id for (row_id,) in db.execute(stmt).fetchall()]
+
+            keys = {(row["stock_code"], row["announce_date"], row["title"]) for row in rows}
+            superseded = [
+                d.id for d in db.query(Disclosure.id, Disclosure.stock_code, Disclosure.announce_date, Disclosure.title).filter(
+                    Disclosure.web_url.in_({row["web_url"] for row in rows}),
+                    Disclosure.announce_date >= datetime.datetime.combine(day, datetime.time()),
+                    Disclosure.announce_date < datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+                ).all()
+                if (d.stock_code, d.announce_date, d.title) not in keys
+            ]
+            if superseded:
+                db.query(Disclosure).filter(Disclosure.id.in_(superseded)).delete(synchronize_session=False)
+            db.commit()
+            print(f"{day}: {len(kept_ids)} inserted or updated, {len(superseded)} superseded disclosures deleted")
+        except Exception as e:
+            print(f"DB Error: {e}")
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if kept_ids:
+            refresh_pending_priorities()
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+if __name__ == "__main__":
+    # 例: python reparse.py --from 2025-05-01 --to 2025-05-31 --codes 7203 --replace
+    parser = argparse.ArgumentParser(description="Rebuild disclosures from the crawl archive")
+    parser.add_argument("--from", dest="date_from", type=parse_date, required=True, help="開始日 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=parse_date, default=datetime.date.today(), help="終了日 (YYYY-MM-DD, 省略時は当日)")
+    parser.add_argument("--codes", help="銘柄コード (カンマ区切り, 省略時は登録済みの全銘柄)")
+    parser.add_argument("--replace", action="store_true", help="対象日の既存レコードを作り直した内容で置き換える")
+    args = parser.parse_args()
+
+    reparser = DisclosureReparser()
+    codes = args.codes.split(",") if args.codes else reparser.disclosure.get_my_stock_code_list()
+    reparser.run(args.date_from, args.date_to, codes, args.replace)
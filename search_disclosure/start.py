@@ -1,28 +1,46 @@
+import os
+import sys
+import signal
 import schedule
 import time
+import threading
 from main import DisclosureClass
+from backfill import DisclosureBackfiller
+
+# docker stop (SIGTERM) でも atexit の後始末 (ブラウザセッションの終了) が動くようにする
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
 # wait for selenium container ready
 print("Search Disclosure Container Started.")
 
 # define class instance
 Disclosure = DisclosureClass()
+Backfiller = DisclosureBackfiller()
 
 # DEV : run once immediately
 # Disclosure.main_process()
 
 # PROD : set run schedule
-schedule.every().monday.at("12:45").do(lambda:Disclosure.main_process())
-schedule.every().tuesday.at("12:45").do(lambda:Disclosure.main_process())
-schedule.every().wednesday.at("12:45").do(lambda:Disclosure.main_process())
-schedule.every().thursday.at("12:45").do(lambda:Disclosure.main_process())
-schedule.every().friday.at("12:45").do(lambda:Disclosure.main_process())
+# 差分クロールなので数分おきに実行する (平日・取得時間帯の判定は incremental_process 内で行う)
+crawl_interval = int(os.environ.get("CRAWL_INTERVAL_MINUTES", "5"))
+schedule.every(crawl_interval).minutes.do(lambda:Disclosure.incremental_process())
+# 新規登録銘柄があれば過去分の開示を取得する
+# 数百日分の取得は時間がかかるので別スレッドで動かし、差分クロールのスケジュールを止めない (同時に1つだけ)
+backfill_thread = None
+def start_backfill():
+    global backfill_thread
+    if backfill_thread is not None and backfill_thread.is_alive():
+        return
+    backfill_thread = threading.Thread(target=run_backfill, daemon=True)
+    backfill_thread.start()
+
+def run_backfill():
+    try:
+        Backfiller.backfill_new_stocks()
+    except Exception as e:
+        print(f"Backfill failed: {e}")
 
-schedule.every().monday.at("19:10").do(lambda:Disclosure.main_process())
-schedule.every().tuesday.at("19:10").do(lambda:Disclosure.main_process())
-schedule.every().wednesday.at("19:10").do(lambda:Disclosure.main_process())
-schedule.every().thursday.at("19:10").do(lambda:Disclosure.main_process())
-schedule.every().friday.at("19:10").do(lambda:Disclosure.main_process())
+schedule.every(10).minutes.do(start_backfill)
 while True:
     schedule.run_pending()
     time.sleep(20)
\ No newline at end of file
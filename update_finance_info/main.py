@@ -1,14 +1,34 @@
+import os
 import time
+import socket
 import jpholiday
 import yfinance as yf
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from sqlalchemy import select, update, and_, or_, literal, exists
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 from common.notification import send_gmail
-from common.database import engine, SessionLocal
-from common.models import Stock, MarketData, DailyAssetSnapshot, DailyGroupSnapshot
+from common.database import engine, SessionLocal, advisory_lock
+from common.models import Stock, MarketData, DailyAssetSnapshot, DailyGroupSnapshot, UpdateRun, UpdateTask, PriceHistory
+
+# 新規銘柄チェックを1レプリカだけで行うためのロックキー
+NEW_STOCKS_LOCK_KEY = 26001
+# 株価履歴の取得を1レプリカだけで行うためのロックキー
+PRICE_HISTORY_LOCK_KEY = 29001
+# 保存済みの終値とこれ以上ずれていたら、分割・配当で調整し直されたとみなす (相対誤差)
+PRICE_ADJUST_TOLERANCE = 0.001
 
 class FinanceUpdater:
     def __init__(self):
+        # 1チャンク(1トランザクション)で更新する銘柄数
+        self.chunk_size = int(os.environ.get("UPDATE_CHUNK_SIZE", "10"))
+        # レプリカ識別子とリース期間 (この時間内にチャンクを処理できなければ他レプリカが引き継ぐ)
+        self.worker_id = os.environ.get("UPDATER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = int(os.environ.get("UPDATE_LEASE_SECONDS", "120"))
+        # リスク分析用の株価履歴 (ベンチマークはTOPIX連動ETF)
+        self.benchmark_code = os.environ.get("BENCHMARK_CODE", "1306")
+        self.history_years = int(os.environ.get("PRICE_HISTORY_YEARS", "2"))
         # 起動時に一度だけ実行（コンテナ再起動時などに即反映させるため）
         self.check_new_stocks()
 
@@ -79,49 +99,220 @@ class FinanceUpdater:
         """
         新規追加された（MarketDataがまだない）銘柄を探して更新する
         """
-        db: Session = SessionLocal()
-        try:
-            # SQL: Stockテーブルにあるが、MarketDataテーブルにレコードがない銘柄を探す
-            # (LEFT JOIN して market_data が NULL のものを抽出)
-            new_stocks = db.query(Stock).outerjoin(
-                MarketData, Stock.stock_code == MarketData.stock_code
-            ).filter(
-                MarketData.stock_code == None
-            ).all()
-
-            if new_stocks:
-                print(f"Found {len(new_stocks)} new stocks. Updating...")
-                for stock in new_stocks:
-                    self._update_single_stock(db, stock.stock_code)
-                db.commit()
-            # else:
-            #    print("No new stocks found.") 
+        with advisory_lock(NEW_STOCKS_LOCK_KEY) as acquired:
+            # 他のレプリカがチェック中なら任せる
+            if not acquired:
+                return
+            db: Session = SessionLocal()
+            try:
+                # SQL: Stockテーブルにあるが、MarketDataテーブルにレコードがない銘柄を探す
+                # (LEFT JOIN して market_data が NULL のものを抽出)
+                new_stocks = db.query(Stock).outerjoin(
+                    MarketData, Stock.stock_code == MarketData.stock_code
+                ).filter(
+                    MarketData.stock_code == None
+                ).all()
 
-        except Exception as e:
-            print(f"Error in check_new_stocks: {e}")
-            db.rollback()
-        finally:
-            db.close()
+                if new_stocks:
+                    print(f"Found {len(new_stocks)} new stocks. Updating...")
+                    for stock in new_stocks:
+                        self._update_single_stock(db, stock.stock_code)
+                    db.commit()
+                # else:
+                #    print("No new stocks found.") 
 
-    def update_all_stocks(self):
+            except Exception as e:
+                print(f"Error in check_new_stocks: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def update_all_stocks(self, slot=None):
         """
         【日次バッチ】全銘柄の情報を更新する
+        銘柄ごとの作業(update_tasks)をリース付きで取得し、チャンク単位でコミットする。
+        複数レプリカが同じ実行に参加して分担し、停止したレプリカの担当分はリース切れ後に他が引き継ぐ。
         """
         # 祝日だった場合、処理を行わない
         if self.check_holiday():
             print("Today is holiday, quit process")
             return None
-        print("Starting daily update...")
+        run_key = self._make_run_key(slot)
+        run_id = self._start_or_join_run(run_key)
+        if run_id is None:
+            print(f"Daily update {run_key} already completed.")
+            return None
+        self._process_run(run_id)
+
+    def resume_interrupted_update(self):
+        """
+        コンテナ再起動時に、本日中断された日次更新があれば参加して再開する
+        """
         db: Session = SessionLocal()
         try:
-            stocks = db.query(Stock).all()
-            for stock in stocks:
-                self._update_single_stock(db, stock.stock_code)
-                time.sleep(1) # API制限考慮で少し待つ
-            # 資産履歴の記録
-            self._record_daily_snapshot(db)
+            today_start = datetime.combine(date.today(), datetime.min.time())
+            run = db.query(UpdateRun).filter(
+                UpdateRun.status == "RUNNING",
+                UpdateRun.started_at >= today_start
+            ).order_by(UpdateRun.started_at.desc()).first()
+            run_id = run.id if run else None
+        finally:
+            db.close()
+        if run_id:
+            print(f"Resuming interrupted daily update (run_id={run_id})")
+            self._process_run(run_id)
+
+    def _make_run_key(self, slot):
+        """日付 + スケジュール時刻 で実行キーを作る (例: 20251215-1800)"""
+        if slot is None:
+            slot = datetime.now().strftime("%H:%M")
+        return f"{date.today().strftime('%Y%m%d')}-{slot.replace(':', '')}"
+
+    def _start_or_join_run(self, run_key):
+        """実行記録と銘柄ごとの作業を(なければ)作成してIDを返す。完了済みならNoneを返す"""
+        db: Session = SessionLocal()
+        try:
+            # 前日以前に中断されたままの実行は破棄する
+            today_start = datetime.combine(date.today(), datetime.min.time())
+            db.query(UpdateRun).filter(
+                UpdateRun.status == "RUNNING",
+                UpdateRun.started_at < today_start
+            ).update({UpdateRun.status: "ABORTED"}, synchronize_session=False)
+
+            # 同時に起動した他レプリカと競合しても1件だけ作られる
+            db.execute(
+                insert(UpdateRun).values(run_key=run_key, status="RUNNING", total_count=0, processed_count=0)
+                .on_conflict_do_nothing(index_elements=[UpdateRun.run_key])
+            )
+            run = db.query(UpdateRun).filter(UpdateRun.run_key == run_key).first()
+            if run.status != "RUNNING":
+                db.commit()
+                return None
+
+            # 全銘柄分の作業を登録 (既に登録済みの銘柄は無視)
+            db.execute(
+                insert(UpdateTask).from_select(
+                    ["run_id", "stock_code", "status"],
+                    select(literal(run.id), Stock.stock_code, literal("PENDING"))
+                ).on_conflict_do_nothing(constraint="uix_update_task_unique")
+            )
+            run.total_count = db.query(UpdateTask).filter(UpdateTask.run_id == run.id).count()
             db.commit()
-            print("Daily update completed.")
+            print(f"Joined daily update {run_key} as {self.worker_id} ({run.processed_count}/{run.total_count} done)")
+            return run.id
+        finally:
+            db.close()
+
+    def _claim_tasks(self, run_id):
+        """未処理またはリース切れの作業をチャンク分取得し、自分のリースを設定する"""
+        db: Session = SessionLocal()
+        try:
+            # 作業登録後に削除された銘柄は更新できない (MarketDataの外部キー違反になる) ので、取得せずに SKIPPED にする
+            skipped = db.execute(
+                update(UpdateTask).where(
+                    UpdateTask.run_id == run_id,
+                    UpdateTask.status.in_(["PENDING", "CLAIMED"]),
+                    ~exists().where(Stock.stock_code == UpdateTask.stock_code)
+                ).values(status="SKIPPED").execution_options(synchronize_session=False)
+            ).rowcount
+            if skipped:
+                print(f"Skipped {skipped} tasks for deleted stocks")
+            # SKIP LOCKED で他レプリカが取得中の行は飛ばす
+            tasks = db.query(UpdateTask).filter(
+                UpdateTask.run_id == run_id,
+                or_(
+                    UpdateTask.status == "PENDING",
+                    and_(UpdateTask.status == "CLAIMED", UpdateTask.lease_expires_at < func.now())
+                )
+            ).order_by(UpdateTask.stock_code.asc()).limit(self.chunk_size).with_for_update(skip_locked=True).all()
+            claimed = []
+            for task in tasks:
+                if task.status == "CLAIMED":
+                    print(f"Taking over expired lease: {task.stock_code} (from {task.owner})")
+                task.status = "CLAIMED"
+                task.owner = self.worker_id
+                task.lease_expires_at = func.now() + timedelta(seconds=self.lease_seconds)
+                claimed.append((task.id, task.stock_code))
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _count_unfinished_tasks(self, run_id):
+        db: Session = SessionLocal()
+        try:
+            return db.query(UpdateTask).filter(UpdateTask.run_id == run_id, UpdateTask.status.in_(["PENDING", "CLAIMED"])).count()
+        finally:
+            db.close()
+
+    def _process_run(self, run_id):
+        """作業をリース付きで取得しながらチャンク単位で更新する"""
+        while True:
+            # 1. 次のチャンクを取得
+            claimed = self._claim_tasks(run_id)
+            if not claimed:
+                # 他レプリカが処理中の作業が残っている場合は、リース切れに備えて待つ
+                if self._count_unfinished_tasks(run_id) > 0:
+                    time.sleep(10)
+                    continue
+                break
+
+            # 2. yfinanceからの取得はトランザクションの外で行う (ロック時間短縮)
+            fetched = []
+            for task_id, code in claimed:
+                fetched.append((task_id, code, self.get_stock_data_from_yfinance(code)))
+                time.sleep(1) # API制限考慮で少し待つ
+
+            # 3. 作業の完了とデータ反映を1トランザクションでコミット
+            #    1銘柄の失敗でチャンク全体がロールバックされないよう、銘柄ごとにセーブポイントを使う
+            db: Session = SessionLocal()
+            try:
+                done_count = 0
+                for task_id, code, data in fetched:
+                    own_task = and_(UpdateTask.id == task_id, UpdateTask.owner == self.worker_id, UpdateTask.status == "CLAIMED")
+                    try:
+                        with db.begin_nested():
+                            # まだ自分がリースを持っている場合のみ反映 (同じ実行で二重に更新しない)
+                            result = db.execute(update(UpdateTask).where(own_task).values(status="DONE"))
+                            if result.rowcount == 1:
+                                self._apply_market_data(db, code, data)
+                                db.flush()
+                    except Exception as e:
+                        # 失敗した銘柄は FAILED にして、この実行では再試行しない (実行全体は完了できる)
+                        print(f"Failed to update {code}: {e}")
+                        db.execute(update(UpdateTask).where(own_task).values(status="FAILED"))
+                        continue
+                    if result.rowcount == 1:
+                        done_count += 1
+                    else:
+                        print(f"Lease lost, skip: {code}")
+                db.execute(
+                    update(UpdateRun).where(UpdateRun.id == run_id)
+                    .values(processed_count=UpdateRun.processed_count + done_count)
+                )
+                db.commit()
+                print(f"Committed chunk: {claimed[0][1]} - {claimed[-1][1]} ({done_count} stocks)")
+            except Exception as e:
+                # 作業はCLAIMEDのまま残るので、リース切れ後に再取得される
+                print(f"Error in daily update: {e}")
+                db.rollback()
+                return
+            finally:
+                db.close()
+
+        # 4. 全作業完了後、最初に完了処理を行ったレプリカだけが資産履歴を記録する
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(UpdateRun).where(UpdateRun.id == run_id, UpdateRun.status == "RUNNING")
+                .values(status="DONE", finished_at=func.now())
+            )
+            if result.rowcount == 1:
+                self._record_daily_snapshot(db)
+                db.commit()
+                print("Daily update completed.")
+            else:
+                db.rollback()
         except Exception as e:
             print(f"Error in daily update: {e}")
             db.rollback()
@@ -131,6 +322,10 @@ class FinanceUpdater:
     def _update_single_stock(self, db: Session, code: str):
         """個別の銘柄を更新・保存する共通処理"""
         data = self.get_stock_data_from_yfinance(code)
+        self._apply_market_data(db, code, data)
+
+    def _apply_market_data(self, db: Session, code: str, data: dict):
+        """取得済みのデータをMarketDataに反映し、目標価格の通知判定を行う"""
         if not data:
             return
         print(f"Updating {code}: {data['current_price']} JPY")
@@ -188,7 +383,7 @@ class FinanceUpdater:
         existing = db.query(DailyAssetSnapshot).filter(DailyAssetSnapshot.date == today).first()
         if existing:
             db.delete(existing)
-            db.commit() # 一旦削除を確定
+            db.flush() # 新規作成より先に削除を反映 (完了処理と同じトランザクション内で行う)
 
         # 新規作成
         snapshot = DailyAssetSnapshot(date=today)
@@ -241,6 +436,109 @@ class FinanceUpdater:
         
         print(f"Recorded snapshot for {today}")
 
+    def update_price_history(self):
+        """
+        登録銘柄とベンチマークの日次終値を yf.download でまとめて取得し、price_historyに追記する
+        既に保存済みの銘柄は最終日以降だけを取得する
+        終値は分割・配当で過去分も調整し直されるので、保存済みの値と重なる日の終値がずれた銘柄は全期間を取り直して置き換える
+        """
+        with advisory_lock(PRICE_HISTORY_LOCK_KEY) as acquired:
+            if not acquired:
+                return
+            db: Session = SessionLocal()
+            try:
+                codes = [row.stock_code for row in db.query(Stock.stock_code).all()] + [self.benchmark_code]
+                last_dates = dict(
+                    db.query(PriceHistory.stock_code, func.max(PriceHistory.date))
+                    .filter(PriceHistory.stock_code.in_(codes))
+                    .group_by(PriceHistory.stock_code).all()
+                )
+            finally:
+                db.close()
+
+            # 取得開始日は、最も古い最終日 (保存済みの値と照合するため最終日も含める。未取得の銘柄があればN年前から)
+            default_start = date.today() - timedelta(days=365 * self.history_years)
+            start = min(last_dates.get(code, default_start) for code in codes)
+            try:
+                closes = self._download_closes(codes, start)
+            except Exception as e:
+                print(f"Error downloading price history: {e}")
+                return
+
+            stale_codes = self._find_adjusted_codes(closes, start)
+            if stale_codes:
+                print(f"Adjusted closes changed for {stale_codes}, refetching since {default_start}")
+                try:
+                    refetched = self._download_closes(stale_codes, default_start)
+                except Exception as e:
+                    print(f"Error downloading price history: {e}")
+                    refetched = {}
+                for code in stale_codes:
+                    # 取り直せなかった銘柄は、ずれた値を追記しないよう今回は更新しない
+                    closes[code] = refetched.get(code, [])
+                stale_codes = [code for code in stale_codes if closes[code]]
+
+            rows = [
+                {"stock_code": code, "date": day, "close": close}
+                for code, series in closes.items() for day, close in series
+            ]
+            if not rows:
+                return
+
+            db = SessionLocal()
+            try:
+                # 取り直した銘柄は古い調整の値を残さないよう入れ替える (同じトランザクション内)
+                if stale_codes:
+                    db.query(PriceHistory).filter(PriceHistory.stock_code.in_(stale_codes)).delete(synchronize_session=False)
+                stmt = insert(PriceHistory)
+                stmt = stmt.on_conflict_do_update(
+                    constraint="uix_price_history_unique",
+                    set_={"close": stmt.excluded.close}
+                )
+                db.execute(stmt, rows)
+                db.commit()
+                print(f"Price history updated: {len(rows)} rows since {start}")
+            except Exception as e:
+                print(f"Error in update_price_history: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def _download_closes(self, codes, start):
+        """yf.download で調整後終値を取得し、{銘柄コード: [(日付, 終値), ...]} を返す"""
+        tickers = [f"{code}.T" for code in codes]
+        data = yf.download(tickers, start=start.isoformat(), group_by="ticker", auto_adjust=True, threads=True, progress=False)
+        closes = {}
+        for code, ticker in zip(codes, tickers):
+            try:
+                series = data[ticker]["Close"].dropna()
+            except KeyError:
+                continue
+            closes[code] = [(ts.date(), float(close)) for ts, close in series.items()]
+        return closes
+
+    def _find_adjusted_codes(self, closes, start):
+        """取得した終値と、重なる日の保存済み終値を比べ、調整し直された (値がずれた) 銘柄を返す"""
+        db: Session = SessionLocal()
+        try:
+            stored = {
+                (row.stock_code, row.date): row.close
+                for row in db.query(PriceHistory.stock_code, PriceHistory.date, PriceHistory.close).filter(
+                    PriceHistory.stock_code.in_(list(closes)),
+                    PriceHistory.date >= start
+                )
+            }
+        finally:
+            db.close()
+        stale = []
+        for code, series in closes.items():
+            for day, close in series:
+                old = stored.get((code, day))
+                if old is not None and abs(close - old) > PRICE_ADJUST_TOLERANCE * abs(old):
+                    stale.append(code)
+                    break
+        return stale
+
     def check_holiday(self):
         today = datetime.today()
         if jpholiday.is_holiday(today):
@@ -0,0 +1,214 @@
+import io
+import os
+import time
+import requests
+import pandas as pd
+import yfinance as yf
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from common.database import SessionLocal, advisory_lock
+from common.models import ScreenerData
+
+# 複数レプリカのうち1つだけが更新するためのロックキー
+SCREENER_LOCK_KEY = 27001
+
+class ScreenerUpdater:
+    """
+    全上場銘柄(約4,000銘柄)のスクリーニング用指標を一括更新する
+    - 銘柄一覧: JPXの上場銘柄一覧(xls)から取得
+    - 株価: yf.download でまとめて取得 (毎回全銘柄)
+    - EPS/BPS/配当: 変化が遅いので、古いものから一定数ずつローテーションで取得
+    PER/PBR/利回り等は 株価 と EPS/BPS/配当 から計算し直す
+    """
+    def __init__(self):
+        self.listed_url = os.environ.get(
+            "JPX_LISTED_URL",
+            "https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq0000001vg2-att/data_j.xls"
+        )
+        self.batch_size = int(os.environ.get("SCREENER_BATCH_SIZE", "200"))                     # yf.download 1回あたりの銘柄数
+        self.fundamentals_per_run = int(os.environ.get("SCREENER_FUNDAMENTALS_PER_RUN", "800"))  # 1回で財務情報を更新する銘柄数
+        self.workers = int(os.environ.get("SCREENER_WORKERS", "8"))                              # 財務情報取得の並列数
+
+    def run(self):
+        """日次のスクリーナー更新処理"""
+        with advisory_lock(SCREENER_LOCK_KEY) as acquired:
+            if not acquired:
+                print("Screener update is running on another replica. Skip.")
+                return
+            print("Starting screener update...")
+            start = time.time()
+            try:
+                self.refresh_universe()
+                self.refresh_fundamentals()
+                self.refresh_prices()
+                print(f"Screener update completed. ({time.time() - start:.1f}s)")
+            except Exception as e:
+                print(f"Error in screener update: {e}")
+
+    def refresh_universe(self):
+        """JPXの上場銘柄一覧から銘柄マスタを更新する (上場廃止銘柄は削除)"""
+        response = requests.get(self.listed_url, timeout=30)
+        response.raise_for_status()
+        df = pd.read_excel(io.BytesIO(response.content), dtype={"コード": str})
+        # 内国株式のみ (ETF・REIT等は除外)
+        df = df[df["市場・商品区分"].astype(str).str.contains("内国株式")]
+        rows = [
+            {
+                "stock_code": str(row["コード"]).strip(),
+                "stock_name": str(row["銘柄名"]).strip(),
+                "market": str(row["市場・商品区分"]).replace("（内国株式）", "").strip(),
+                "sector": str(row["33業種区分"]).strip(),
+            }
+            for _, row in df.iterrows()
+        ]
+        if not rows:
+            print("Listed company list is empty. Skip universe refresh.")
+            return
+
+        db: Session = SessionLocal()
+        try:
+            stmt = insert(ScreenerData).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ScreenerData.stock_code],
+                set_={
+                    "stock_name": stmt.excluded.stock_name,
+                    "market": stmt.excluded.market,
+                    "sector": stmt.excluded.sector,
+                }
+            )
+            db.execute(stmt)
+            codes = [row["stock_code"] for row in rows]
+            deleted = db.query(ScreenerData).filter(ScreenerData.stock_code.notin_(codes)).delete(synchronize_session=False)
+            db.commit()
+            print(f"Universe refreshed: {len(rows)} stocks ({deleted} delisted)")
+        except Exception as e:
+            print(f"Error in refresh_universe: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def refresh_fundamentals(self):
+        """EPS/BPS/配当を、更新日時が古い銘柄から一定数だけ取得する"""
+        db: Session = SessionLocal()
+        try:
+            codes = [
+                row.stock_code for row in db.query(ScreenerData.stock_code)
+                .order_by(ScreenerData.fundamentals_updated_at.asc().nullsfirst())
+                .limit(self.fundamentals_per_run).all()
+            ]
+        finally:
+            db.close()
+        if not codes:
+            return
+
+        # ネットワーク待ちが支配的なのでスレッドで並列取得
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self._fetch_fundamentals, codes))
+
+        # 取得できた銘柄だけ更新日時を進める (失敗した銘柄はローテーションの先頭に残り、次回また取得する)
+        now = datetime.now()
+        mappings = [
+            {"stock_code": code, "fundamentals_updated_at": now, **data}
+            for code, data in zip(codes, results) if data
+        ]
+        failed = len(codes) - len(mappings)
+        if failed:
+            print(f"Failed to fetch fundamentals for {failed} stocks, will retry next run")
+        if not mappings:
+            return
+
+        db = SessionLocal()
+        try:
+            # 主キー指定の一括UPDATE (executemany)
+            db.execute(update(ScreenerData), mappings)
+            db.commit()
+            print(f"Fundamentals refreshed: {len(mappings)} stocks")
+        except Exception as e:
+            print(f"Error in refresh_fundamentals: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _fetch_fundamentals(self, code):
+        try:
+            info = yf.Ticker(f"{code}.T").info
+            return {
+                "eps": info.get("trailingEps"),
+                "bps": info.get("bookValue"),
+                "dividend_amount": info.get("dividendRate"),
+            }
+        except Exception as e:
+            print(f"Error fetching fundamentals {code}: {e}")
+            return None
+
+    def refresh_prices(self):
+        """全銘柄の終値を yf.download でまとめて取得し、指標を再計算する"""
+        db: Session = SessionLocal()
+        try:
+            records = db.query(
+                ScreenerData.stock_code, ScreenerData.eps, ScreenerData.bps, ScreenerData.dividend_amount
+            ).all()
+        finally:
+            db.close()
+
+        now = datetime.now()
+        mappings = []
+        for i in range(0, len(records), self.batch_size):
+            batch = records[i:i + self.batch_size]
+            closes = self._download_closes([r.stock_code for r in batch])
+            for r in batch:
+                price = closes.get(r.stock_code)
+                if price is None:
+                    continue
+                mapping = {"stock_code": r.stock_code, "current_price": price, "price_updated_at": now}
+                mapping.update(self._derive_metrics(price, r.eps, r.bps, r.dividend_amount))
+                mappings.append(mapping)
+
+        db = SessionLocal()
+        try:
+            db.execute(update(ScreenerData), mappings)
+            db.commit()
+            print(f"Prices refreshed: {len(mappings)}/{len(records)} stocks")
+        except Exception as e:
+            print(f"Error in refresh_prices: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _download_closes(self, codes):
+        """{銘柄コード: 直近終値} を返す"""
+        tickers = [f"{code}.T" for code in codes]
+        closes = {}
+        try:
+            data = yf.download(tickers, period="5d", group_by="ticker", threads=True, progress=False, auto_adjust=False)
+        except Exception as e:
+            print(f"Error downloading prices: {e}")
+            return closes
+        for code, ticker in zip(codes, tickers):
+            try:
+                series = data[ticker]["Close"].dropna()
+            except KeyError:
+                continue
+            if not series.empty:
+                closes[code] = float(series.iloc[-1])
+        return closes
+
+    def _derive_metrics(self, price, eps, bps, dividend_amount):
+        """株価とEPS/BPS/配当からスクリーニング指標を計算する"""
+        per = round(price / eps, 2) if eps is not None and eps > 0 else None
+        pbr = round(price / bps, 2) if bps is not None and bps > 0 else None
+        return {
+            "per": per,
+            "pbr": pbr,
+            # ミックス係数 (PER * PBR)
+            "mix_coefficient": per * pbr if per is not None and pbr is not None else None,
+            # 配当利回り (%)
+            "dividend_yield": round(dividend_amount / price * 100, 2) if dividend_amount is not None and price > 0 else None,
+            # 配当性向 (%)
+            "payout_ratio": dividend_amount / eps * 100 if dividend_amount is not None and eps is not None and eps > 0 else None,
+            # 黒字判定 (EPSがプラスなら黒字)
+            "is_profitable": eps is not None and eps > 0,
+        }
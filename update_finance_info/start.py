@@ -1,23 +1,41 @@
 import time
 import schedule
 from main import FinanceUpdater
+from screener import ScreenerUpdater
 
 if __name__ == "__main__":
     updater = FinanceUpdater()
+    # 再起動前に中断された日次更新があれば、最後にコミットした銘柄の次から再開する
+    updater.resume_interrupted_update()
+    screener = ScreenerUpdater()
 
     # 1. バッチのスケジュール設定
     # 現在値など市場情報は10:00と18:00に更新
-    schedule.every().monday.at("10:00").do(updater.update_all_stocks)
-    schedule.every().tuesday.at("10:00").do(updater.update_all_stocks)
-    schedule.every().wednesday.at("10:00").do(updater.update_all_stocks)
-    schedule.every().thursday.at("10:00").do(updater.update_all_stocks)
-    schedule.every().friday.at("10:00").do(updater.update_all_stocks)
-
-    schedule.every().monday.at("18:00").do(updater.update_all_stocks)
-    schedule.every().tuesday.at("18:00").do(updater.update_all_stocks)
-    schedule.every().wednesday.at("18:00").do(updater.update_all_stocks)
-    schedule.every().thursday.at("18:00").do(updater.update_all_stocks)
-    schedule.every().friday.at("18:00").do(updater.update_all_stocks)
+    schedule.every().monday.at("10:00").do(updater.update_all_stocks, "10:00")
+    schedule.every().tuesday.at("10:00").do(updater.update_all_stocks, "10:00")
+    schedule.every().wednesday.at("10:00").do(updater.update_all_stocks, "10:00")
+    schedule.every().thursday.at("10:00").do(updater.update_all_stocks, "10:00")
+    schedule.every().friday.at("10:00").do(updater.update_all_stocks, "10:00")
+
+    schedule.every().monday.at("18:00").do(updater.update_all_stocks, "18:00")
+    schedule.every().tuesday.at("18:00").do(updater.update_all_stocks, "18:00")
+    schedule.every().wednesday.at("18:00").do(updater.update_all_stocks, "18:00")
+    schedule.every().thursday.at("18:00").do(updater.update_all_stocks, "18:00")
+    schedule.every().friday.at("18:00").do(updater.update_all_stocks, "18:00")
+
+    # 2. リスク分析用の株価履歴は引け後に1日1回追記
+    schedule.every().monday.at("18:20").do(updater.update_price_history)
+    schedule.every().tuesday.at("18:20").do(updater.update_price_history)
+    schedule.every().wednesday.at("18:20").do(updater.update_price_history)
+    schedule.every().thursday.at("18:20").do(updater.update_price_history)
+    schedule.every().friday.at("18:20").do(updater.update_price_history)
+
+    # 3. 全上場銘柄のスクリーナー指標は引け後に1日1回更新
+    schedule.every().monday.at("18:30").do(screener.run)
+    schedule.every().tuesday.at("18:30").do(screener.run)
+    schedule.every().wednesday.at("18:30").do(screener.run)
+    schedule.every().thursday.at("18:30").do(screener.run)
+    schedule.every().friday.at("18:30").do(screener.run)
 
     print("Update Finance Info Container Started.")
 